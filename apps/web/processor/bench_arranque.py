@@ -0,0 +1,132 @@
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+# Tiempo de arranque de cada script del procesador: `python -X importtime`
+# (costo de importar el módulo, con los imports más pesados) y el tiempo de
+# pared de una invocación trivial (sin argumentos: imprime el uso y sale).
+#
+#   python bench_arranque.py
+#   python bench_arranque.py --guardar arranque.json          # línea base
+#   python bench_arranque.py --comparar arranque.json --max-ms 500
+
+AQUI = os.path.dirname(os.path.abspath(__file__))
+
+SCRIPTS = {
+    # módulo -> se invoca también como script (uso y salida)
+    "procesar_subtitulos": True,
+    "procesar_texto": True,
+    "procesar_texto_lote": True,
+    "cola_trabajos": False,  # sin argumentos arranca el daemon
+    "media_cache": False,
+    "descargas": False,
+}
+
+
+def _importtime(modulo: str):
+    # (ms totales, [(ms acumulados, nombre)] de los imports directos)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {modulo}"],
+        cwd=AQUI,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "falló el import")
+
+    # importtime imprime cada módulo al terminar de cargarlo, después de sus
+    # hijos: los de primer nivel del script son los de profundidad 1 que van
+    # entre la línea anterior de profundidad 0 (site, etc.) y la suya
+    total = 0.0
+    hijos = []
+    pendientes = []
+    for linea in proc.stderr.splitlines():
+        if not linea.startswith("import time:") or "|" not in linea:
+            continue
+        _, acumulado, nombre = linea.split("|", 2)
+        try:
+            us = int(acumulado.strip())
+        except ValueError:
+            continue  # cabecera
+        profundidad = (len(nombre) - len(nombre.lstrip())) // 2
+        nombre = nombre.strip()
+        if profundidad == 0:
+            if nombre == modulo:
+                total = us / 1000
+                hijos = pendientes
+            pendientes = []
+        elif profundidad == 1:
+            pendientes.append((us / 1000, nombre))
+    return total, sorted(hijos, reverse=True)
+
+
+def _invocacion_trivial(modulo: str, repeticiones: int) -> float:
+    tiempos = []
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        subprocess.run(
+            [sys.executable, os.path.join(AQUI, f"{modulo}.py")],
+            cwd=AQUI,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        tiempos.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(tiempos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiempo de arranque de los scripts del procesador")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5, help="imports más pesados a mostrar")
+    parser.add_argument("--guardar", help="escribe los resultados en este JSON")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior")
+    parser.add_argument("--max-ms", type=float, default=0, help="sale con 1 si una invocación trivial lo supera")
+    args = parser.parse_args()
+
+    anterior = {}
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            anterior = json.load(f)
+
+    resultados = {}
+    excedidos = []
+    for modulo, invocable in SCRIPTS.items():
+        try:
+            # la primera corrida calienta la caché de bytecode
+            _importtime(modulo)
+            muestras = [_importtime(modulo) for _ in range(args.repeticiones)]
+        except RuntimeError as e:
+            print(f" {modulo:<20} no se pudo importar: {e}")
+            continue
+        import_ms = statistics.median(m[0] for m in muestras)
+        hijos = muestras[-1][1]
+        trivial_ms = _invocacion_trivial(modulo, args.repeticiones) if invocable else None
+        resultados[modulo] = {"import_ms": round(import_ms, 1), "trivial_ms": trivial_ms and round(trivial_ms, 1)}
+
+        previo = anterior.get(modulo, {}).get("import_ms")
+        delta = f"  ({import_ms - previo:+.1f} ms)" if previo is not None else ""
+        linea = f" {modulo:<20} import {import_ms:8.1f} ms{delta}"
+        if trivial_ms is not None:
+            linea += f"   invocación trivial {trivial_ms:8.1f} ms"
+            if args.max_ms and trivial_ms > args.max_ms:
+                excedidos.append(modulo)
+        print(linea)
+        for ms, nombre in hijos[: args.top]:
+            print(f"     {ms:8.1f} ms  {nombre}")
+
+    if args.guardar:
+        with open(args.guardar, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2)
+        print(f" Resultados guardados en {args.guardar}")
+
+    if excedidos:
+        print(f" ❌ Superan {args.max_ms:.0f} ms: {', '.join(excedidos)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
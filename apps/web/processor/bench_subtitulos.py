@@ -0,0 +1,281 @@
+import os
+import sys
+import time
+import json
+import argparse
+import difflib
+import resource
+import subprocess
+import statistics
+
+# Benchmarks del pipeline de subtítulos. No tocan la base de datos: trabajan
+# sobre un clip local de referencia (cualquier formato que ffmpeg entienda).
+#
+#   python bench_subtitulos.py frio-caliente clip.wav --repeticiones 3
+
+AQUI = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, AQUI)
+
+
+def _fmt(valores):
+    if not valores:
+        return "-"
+    return f"media {statistics.mean(valores):.2f}s  min {min(valores):.2f}s  max {max(valores):.2f}s"
+
+
+# ----------------- Modelo frío vs residente (worker) -----------------
+def _una_vez(clip: str):
+    # Lo que paga cada upload sin worker: import + carga del modelo + transcripción
+    import procesar_subtitulos as ps
+
+    model = ps.get_model()
+    audio = ps.decode_audio(clip)
+    list(ps.transcribir_audio(model, audio))
+
+
+def bench_frio_caliente(clip: str, repeticiones: int):
+    print(f" Clip de referencia: {clip}")
+
+    frio = []
+    for i in range(repeticiones):
+        t0 = time.perf_counter()
+        subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "_una-vez", clip],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        frio.append(time.perf_counter() - t0)
+        print(f"  frío     #{i+1}: {frio[-1]:.2f}s")
+
+    import procesar_subtitulos as ps
+
+    model = ps.get_model()
+    caliente = []
+    for i in range(repeticiones):
+        # el worker residente solo se ahorra import + carga del modelo: la
+        # decodificación la paga en cada trabajo igual que el proceso frío
+        t0 = time.perf_counter()
+        audio = ps.decode_audio(clip)
+        list(ps.transcribir_audio(model, audio))
+        caliente.append(time.perf_counter() - t0)
+        print(f"  caliente #{i+1}: {caliente[-1]:.2f}s")
+
+    print()
+    print(f" Modelo: {ps.WHISPER_MODEL}")
+    print(f" Frío (proceso nuevo por upload): {_fmt(frio)}")
+    print(f" Caliente (worker residente):     {_fmt(caliente)}")
+    if frio and caliente:
+        print(f" Ahorro por trabajo: {statistics.mean(frio) - statistics.mean(caliente):.2f}s")
+
+
+# ----------------- Ventanas fijas vs VAD -----------------
+def bench_vad(clip: str):
+    import procesar_subtitulos as ps
+
+    model = ps.get_model()
+    audio = ps.decode_audio(clip)
+    dur = len(audio) / ps.SAMPLE_RATE
+
+    resultados = {}
+    for nombre, ventanas in (
+        ("fijas 15s", ps.fragmentos_fijos([audio])),
+        ("VAD", ps.segmentar_por_voz([audio])),
+    ):
+        t0 = time.perf_counter()
+        n = len(list(ps.transcribir_fragmentos(model, ventanas)))
+        resultados[nombre] = (time.perf_counter() - t0, n)
+
+    print()
+    print(f" Clip: {clip} ({dur:.1f}s de audio)")
+    for nombre, (seg, n) in resultados.items():
+        print(f"  {nombre:<10} {seg:8.2f}s  RTF {seg / dur:.3f}  segmentos {n}")
+
+
+# ----------------- Real-time factor por tamaño de lote -----------------
+def bench_lotes(clip: str, tamanos: str, hilos: int):
+    import procesar_subtitulos as ps
+
+    if hilos > 0:
+        ps.NUM_HILOS = hilos
+    model = ps.get_model()
+    audio = ps.decode_audio(clip)
+    dur = len(audio) / ps.SAMPLE_RATE
+    ventanas = list(ps.ventanas_de_audio([audio]))
+
+    print()
+    print(f" Clip: {clip} ({dur:.1f}s de audio, {len(ventanas)} ventanas)")
+    import torch  # type: ignore
+
+    print(f" Hilos torch: {torch.get_num_threads()}")
+    for n in [int(x) for x in tamanos.split(",") if x.strip()]:
+        ps.BATCH_SIZE = n
+        t0 = time.perf_counter()
+        segs = len(list(ps.transcribir_fragmentos(model, ventanas)))
+        seg = time.perf_counter() - t0
+        print(f"  batch {n:>2}: {seg:8.2f}s  RTF {seg / dur:.3f}  segmentos {segs}")
+
+
+# ----------------- Comparación de backends ASR -----------------
+def _backend_una_vez(nombre: str, clip: str, salida: str):
+    # Corre en un proceso aparte para medir memoria pico de cada motor por separado
+    import procesar_subtitulos as ps
+
+    t0 = time.perf_counter()
+    model = ps.get_model(nombre)
+    carga = time.perf_counter() - t0
+    audio = ps.decode_audio(clip)
+
+    t0 = time.perf_counter()
+    segs = list(ps.transcribir_fragmentos(model, ps.ventanas_de_audio([audio])))
+    seg = time.perf_counter() - t0
+
+    with open(salida, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "carga": carga,
+                "segundos": seg,
+                "duracion": len(audio) / ps.SAMPLE_RATE,
+                "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                "texto": " ".join(t for _, _, t in segs),
+                "segmentos": len(segs),
+            },
+            f,
+        )
+
+
+def bench_backends(clip: str, nombres: str):
+    import tempfile
+
+    resultados = {}
+    for nombre in [n.strip() for n in nombres.split(",") if n.strip()]:
+        fd, salida = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        try:
+            subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "_backend", nombre, clip, salida],
+                check=True,
+                stdout=subprocess.DEVNULL,
+            )
+            with open(salida, encoding="utf-8") as f:
+                resultados[nombre] = json.load(f)
+        finally:
+            os.remove(salida)
+
+    if not resultados:
+        return
+    referencia = next(iter(resultados))
+    palabras_ref = resultados[referencia]["texto"].lower().split()
+
+    print()
+    print(f" Clip: {clip} ({next(iter(resultados.values()))['duracion']:.1f}s de audio)")
+    print(f" Similitud de palabras contra '{referencia}'")
+    for nombre, r in resultados.items():
+        sim = difflib.SequenceMatcher(None, palabras_ref, r["texto"].lower().split()).ratio()
+        print(
+            f"  {nombre:<8} carga {r['carga']:6.1f}s  RTF {r['segundos'] / r['duracion']:.3f}  "
+            f"RSS pico {r['rss_mb']:7.0f} MB  segmentos {r['segmentos']:4d}  similitud {sim:.3f}"
+        )
+
+
+# ----------------- Inserts fila a fila vs en bloque -----------------
+def bench_inserts(filas: int):
+    import io
+    import psycopg2
+    import psycopg2.extras
+    import procesar_subtitulos as ps
+
+    datos = [("bench", i * 2.0, i * 2.0 + 1.5, f"segmento de prueba número {i}") for i in range(filas)]
+    conn = psycopg2.connect(**ps.DB_CONFIG)
+    cur = conn.cursor()
+    cur.execute(
+        "CREATE TEMP TABLE bench_subtitulos (video_id text, time_start real, time_end real, text text)"
+    )
+
+    def fila_a_fila():
+        for d in datos:
+            cur.execute(
+                "INSERT INTO bench_subtitulos (video_id, time_start, time_end, text) VALUES (%s, %s, %s, %s)",
+                d,
+            )
+
+    def execute_values():
+        for i in range(0, len(datos), ps.INSERT_LOTE):
+            psycopg2.extras.execute_values(
+                cur,
+                "INSERT INTO bench_subtitulos (video_id, time_start, time_end, text) VALUES %s",
+                datos[i : i + ps.INSERT_LOTE],
+                page_size=ps.INSERT_LOTE,
+            )
+
+    def copy():
+        buf = io.StringIO()
+        for v, a, b, t in datos:
+            buf.write(f"{v}\t{a}\t{b}\t{t}\n")
+        buf.seek(0)
+        cur.copy_from(buf, "bench_subtitulos", columns=("video_id", "time_start", "time_end", "text"))
+
+    print(f" {filas} filas, bloque de {ps.INSERT_LOTE}")
+    try:
+        for nombre, fn in (("fila a fila", fila_a_fila), ("execute_values", execute_values), ("COPY", copy)):
+            cur.execute("TRUNCATE bench_subtitulos")
+            conn.commit()
+            t0 = time.perf_counter()
+            fn()
+            conn.commit()
+            seg = time.perf_counter() - t0
+            print(f"  {nombre:<15} {seg:7.3f}s  {filas / seg:10.0f} filas/s")
+    finally:
+        cur.close()
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de procesar_subtitulos.py")
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    p = sub.add_parser("frio-caliente", help="latencia con modelo frío vs worker residente")
+    p.add_argument("clip")
+    p.add_argument("--repeticiones", type=int, default=3)
+
+    p = sub.add_parser("vad", help="tiempo de decodificación con ventanas fijas vs VAD")
+    p.add_argument("clip")
+
+    p = sub.add_parser("lotes", help="real-time factor por tamaño de lote")
+    p.add_argument("clip")
+    p.add_argument("--tamanos", default="1,2,4,8")
+    p.add_argument("--hilos", type=int, default=0)
+
+    p = sub.add_parser("backends", help="RTF, memoria y calidad de cada backend ASR")
+    p.add_argument("clip")
+    p.add_argument("--backends", default="whisper,ct2")
+
+    p = sub.add_parser("inserts", help="filas/s: insert por fila vs execute_values vs COPY")
+    p.add_argument("--filas", type=int, default=20000)
+
+    p = sub.add_parser("_backend")
+    p.add_argument("nombre")
+    p.add_argument("clip")
+    p.add_argument("salida")
+
+    p = sub.add_parser("_una-vez")
+    p.add_argument("clip")
+
+    args = parser.parse_args()
+    if args.bench == "frio-caliente":
+        bench_frio_caliente(args.clip, args.repeticiones)
+    elif args.bench == "vad":
+        bench_vad(args.clip)
+    elif args.bench == "lotes":
+        bench_lotes(args.clip, args.tamanos, args.hilos)
+    elif args.bench == "backends":
+        bench_backends(args.clip, args.backends)
+    elif args.bench == "inserts":
+        bench_inserts(args.filas)
+    elif args.bench == "_backend":
+        _backend_una_vez(args.nombre, args.clip, args.salida)
+    elif args.bench == "_una-vez":
+        _una_vez(args.clip)
+
+
+if __name__ == "__main__":
+    main()
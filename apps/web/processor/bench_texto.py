@@ -0,0 +1,117 @@
+import os
+import sys
+import time
+import argparse
+import statistics
+
+# Benchmarks de la extracción de texto. No tocan la base de datos: trabajan
+# sobre un corpus local (por ejemplo, uploads .txt/.csv/.srt bajados de MinIO).
+#
+#   python bench_texto.py encoding corpus/ --repeticiones 3
+
+AQUI = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, AQUI)
+
+EXTENSIONES = (".txt", ".csv", ".srt")
+
+
+def _corpus(rutas):
+    archivos = []
+    for ruta in rutas:
+        if os.path.isdir(ruta):
+            for raiz, _, nombres in os.walk(ruta):
+                archivos.extend(
+                    os.path.join(raiz, n) for n in sorted(nombres) if n.lower().endswith(EXTENSIONES)
+                )
+        else:
+            archivos.append(ruta)
+    return archivos
+
+
+def _medir(fn, repeticiones: int):
+    tiempos = []
+    resultado = None
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        resultado = fn()
+        tiempos.append(time.perf_counter() - t0)
+    return statistics.median(tiempos), resultado
+
+
+# ----------------- Detección de encoding -----------------
+def _chardet_completo(path: str) -> str:
+    # lo que se hacía antes: el archivo entero a chardet.detect
+    import chardet  # type: ignore
+
+    with open(path, "rb") as fb:
+        raw = fb.read()
+    return chardet.detect(raw).get("encoding") or "utf-8"
+
+
+def _mismo_texto(path: str, a: str, b: str) -> bool:
+    # dos nombres distintos pueden decodificar igual (ascii / utf-8, ...)
+    with open(path, "rb") as fb:
+        raw = fb.read()
+    try:
+        return raw.decode(a, errors="replace") == raw.decode(b, errors="replace")
+    except LookupError:
+        return False
+
+
+def bench_encoding(rutas, repeticiones: int):
+    import procesar_texto as pt
+
+    archivos = _corpus(rutas)
+    if not archivos:
+        print(f" Sin archivos {'/'.join(EXTENSIONES)} en {', '.join(rutas)}")
+        return
+    print(f" {len(archivos)} archivos")
+
+    por_ext: dict = {}
+    distintos = []
+    for path in archivos:
+        mb = os.path.getsize(path) / 1e6
+        t_antes, enc_antes = _medir(lambda: _chardet_completo(path), repeticiones)
+        t_ahora, enc_ahora = _medir(lambda: pt._detectar_encoding(path), repeticiones)
+        ext = os.path.splitext(path)[1].lower()
+        fila = por_ext.setdefault(ext, [0, 0.0, 0.0, 0.0])
+        fila[0] += 1
+        fila[1] += mb
+        fila[2] += t_antes
+        fila[3] += t_ahora
+        igual = enc_antes == enc_ahora or _mismo_texto(path, enc_antes, enc_ahora)
+        if not igual:
+            distintos.append((path, enc_antes, enc_ahora))
+        print(
+            f"  {os.path.basename(path)[:40]:<40} {mb:8.1f} MB  "
+            f"completo {t_antes * 1000:9.1f} ms ({enc_antes})  "
+            f"muestreo {t_ahora * 1000:7.1f} ms ({enc_ahora}){'' if igual else '  ≠'}"
+        )
+
+    print()
+    for ext, (n, mb, antes, ahora) in sorted(por_ext.items()):
+        print(
+            f" {ext:<5} {n:4d} archivos {mb:9.1f} MB   completo {antes:8.2f}s   "
+            f"muestreo {ahora:6.3f}s   x{antes / max(ahora, 1e-9):.0f}"
+        )
+    if distintos:
+        print(f" ⚠️ {len(distintos)} archivos decodifican distinto:")
+        for path, a, b in distintos:
+            print(f"    {path}: {a} -> {b}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de la extracción de texto")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("encoding", help="chardet sobre el archivo entero vs muestreo acotado")
+    p.add_argument("rutas", nargs="+", help="archivos o directorios (.txt/.csv/.srt)")
+    p.add_argument("--repeticiones", type=int, default=3)
+
+    args = parser.parse_args()
+    if args.cmd == "encoding":
+        bench_encoding(args.rutas, args.repeticiones)
+
+
+if __name__ == "__main__":
+    main()
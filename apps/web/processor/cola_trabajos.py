@@ -0,0 +1,452 @@
+import os
+import sys
+import json
+import time
+import select
+import socket
+import subprocess
+import threading
+import traceback
+from typing import Dict, Optional, Tuple
+
+import psycopg2
+import psycopg2.extensions
+
+# ----------------- Cola de trabajos en Postgres -----------------
+# /api/upload-minio ya no lanza un proceso de Python por archivo: inserta una
+# fila en 'trabajos' y este daemon la toma con SELECT ... FOR UPDATE SKIP LOCKED.
+# Corre los procesadores dentro del mismo proceso (el modelo de Whisper se
+# carga una sola vez) con un número acotado de hilos.
+#
+#   python processor/cola_trabajos.py                    # daemon
+#   python processor/cola_trabajos.py encolar <upload_id> subtitulos|texto
+#
+# Estados: pendiente -> en_proceso -> completado | error (tras max_intentos).
+#
+# Carriles: cada tipo de trabajo tiene sus propios hilos, así un .docx de 5
+# páginas nunca espera detrás de horas de Whisper. Dentro de un carril se toma
+# primero el de menor costo estimado (segundos de proceso), con envejecimiento
+# para que los largos no esperen para siempre. Un carril ocioso ayuda a los
+# carriles más baratos (nunca al revés).
+#
+# El carril "pesado" tiene un solo hilo por proceso: el modelo de Whisper se
+# comparte entre hilos y no admite decodificaciones concurrentes. Para
+# transcribir varios videos a la vez se levantan más réplicas del servicio
+# (cada proceso con su propio modelo).
+
+AQUI = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, AQUI)
+
+DB_CONFIG = {
+    "dbname": os.getenv("PGDATABASE", "atomica_stremmer"),
+    "user": os.getenv("PGUSER", "postgres"),
+    "password": os.getenv("PGPASSWORD", "atomica"),
+    "host": os.getenv("PGHOST", "localhost"),
+    "port": os.getenv("PGPORT", "5432"),
+}
+
+CARRILES: Dict[str, Tuple[str, ...]] = {
+    # carril -> tipos que atiende, en orden de preferencia
+    "rapido": ("texto",),
+    "pesado": ("subtitulos", "texto"),
+}
+COLA_WORKERS = {
+    "rapido": max(1, int(os.getenv("COLA_WORKERS_RAPIDO", "2"))),
+    "pesado": max(1, int(os.getenv("COLA_WORKERS_PESADO", "1"))),  # se acota a 1 (ver run_daemon)
+}
+COLA_CANAL = "trabajos"  # NOTIFY al encolar: despierta a los workers sin esperar el sondeo
+COLA_SONDEO_S = 5.0
+COLA_LATIDO_S = 30.0
+COLA_ABANDONO_S = 300  # en_proceso sin latido por más de esto: se vuelve a tomar
+COLA_REINTENTO_BASE_S = 30  # espera antes de reintentar: base * 2^(intento-1)
+COLA_MAX_INTENTOS = 3
+
+# Costo estimado (segundos de proceso). Subtítulos: duración (ffprobe) por el
+# real-time factor; sin duración, se deduce del tamaño. Texto: por tamaño.
+COSTO_RTF_SUBTITULOS = float(os.getenv("COLA_RTF_SUBTITULOS", "0.5"))
+COSTO_BYTES_POR_S_VIDEO = 250_000  # ~2 Mbit/s
+COSTO_BYTES_POR_S_TEXTO = 2_000_000
+COLA_ENVEJECIMIENTO = 1.0  # segundos de costo que se descuentan por segundo de espera
+
+TIPOS = ("subtitulos", "texto")
+
+SQL_TRABAJOS = """
+    CREATE TABLE IF NOT EXISTS trabajos (
+        id bigserial PRIMARY KEY,
+        upload_id text NOT NULL REFERENCES uploads(id),
+        tipo text NOT NULL,
+        estado text NOT NULL DEFAULT 'pendiente',
+        prioridad integer NOT NULL DEFAULT 0,
+        intentos integer NOT NULL DEFAULT 0,
+        max_intentos integer NOT NULL DEFAULT 3,
+        payload jsonb,
+        resultado jsonb,
+        error text,
+        worker text,
+        disponible_en timestamp without time zone NOT NULL DEFAULT now(),
+        creado_en timestamp without time zone NOT NULL DEFAULT now(),
+        iniciado_en timestamp without time zone,
+        latido_en timestamp without time zone,
+        terminado_en timestamp without time zone
+    )
+"""
+
+SQL_TRABAJOS_IDX = [
+    """
+    CREATE INDEX IF NOT EXISTS trabajos_pendientes_idx
+        ON trabajos (prioridad DESC, id) WHERE estado = 'pendiente'
+    """,
+    # un mismo upload no se encola dos veces mientras siga activo
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS trabajos_activos_uidx
+        ON trabajos (upload_id, tipo) WHERE estado IN ('pendiente', 'en_proceso')
+    """,
+    "CREATE INDEX IF NOT EXISTS trabajos_upload_idx ON trabajos (upload_id)",
+]
+
+SQL_TRABAJOS_COSTO = "ALTER TABLE trabajos ADD COLUMN IF NOT EXISTS costo real"
+
+SQL_TOMAR = """
+    UPDATE trabajos
+       SET estado = 'en_proceso',
+           intentos = intentos + 1,
+           worker = %(worker)s,
+           iniciado_en = now(),
+           latido_en = now(),
+           error = NULL
+     WHERE id = (
+        SELECT t.id
+          FROM trabajos t
+          LEFT JOIN uploads u ON u.id = t.upload_id
+         WHERE t.tipo = %(tipo)s
+           AND ((t.estado = 'pendiente' AND t.disponible_en <= now())
+                OR (t.estado = 'en_proceso'
+                    AND t.latido_en < now() - %(abandono)s * interval '1 second'
+                    AND t.intentos < t.max_intentos))
+         ORDER BY t.prioridad DESC,
+                  -- sin estimar todavía: se aproxima por tamaño
+                  COALESCE(t.costo, COALESCE(u.size_in_bytes, 0)::real / %(bytes_por_s)s)
+                    - EXTRACT(EPOCH FROM now() - t.creado_en) * %(envejecimiento)s,
+                  t.id
+         LIMIT 1
+         FOR UPDATE OF t SKIP LOCKED
+     )
+    RETURNING id, upload_id, tipo, payload, intentos, max_intentos
+"""
+
+
+# abandonados que ya agotaron sus intentos (p. ej. el proceso muere por memoria
+# cada vez): no se retoman más
+SQL_CERRAR_ABANDONADOS = """
+    UPDATE trabajos
+       SET estado = 'error', error = 'abandonado (sin latido)', terminado_en = now()
+     WHERE estado = 'en_proceso'
+       AND latido_en < now() - %(abandono)s * interval '1 second'
+       AND intentos >= max_intentos
+"""
+
+
+def _conectar():
+    return psycopg2.connect(**DB_CONFIG)
+
+
+def asegurar_tablas(conn):
+    with conn.cursor() as cur:
+        cur.execute(SQL_TRABAJOS)
+        cur.execute(SQL_TRABAJOS_COSTO)
+        for sql in SQL_TRABAJOS_IDX:
+            cur.execute(sql)
+    conn.commit()
+
+
+def encolar(
+    cur,
+    upload_id: str,
+    tipo: str,
+    payload: Optional[dict] = None,
+    prioridad: int = 0,
+    costo: Optional[float] = None,
+) -> Optional[int]:
+    # Devuelve el id, o None si ya había uno activo para ese upload
+    cur.execute(
+        """
+        INSERT INTO trabajos (upload_id, tipo, payload, prioridad, max_intentos, costo)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        ON CONFLICT (upload_id, tipo) WHERE estado IN ('pendiente', 'en_proceso') DO NOTHING
+        RETURNING id
+        """,
+        (upload_id, tipo, json.dumps(payload) if payload else None, prioridad, COLA_MAX_INTENTOS, costo),
+    )
+    row = cur.fetchone()
+    cur.execute("SELECT pg_notify(%s, %s)", (COLA_CANAL, tipo))
+    return row[0] if row else None
+
+
+# ----------------- Ejecución de cada tipo -----------------
+# Un solo trabajo de subtítulos a la vez por proceso: todos los hilos usan el
+# mismo modelo (procesar_subtitulos._model) y los hooks del KV-cache de Whisper
+# no admiten dos decodificaciones concurrentes sobre la misma instancia.
+_SUBTITULOS_LOCK = threading.Lock()
+
+
+def _ejecutar(tipo: str, upload_id: str, payload: dict) -> dict:
+    # Import diferido: un daemon solo de texto no carga torch/whisper
+    if tipo == "subtitulos":
+        import procesar_subtitulos as ps
+
+        with _SUBTITULOS_LOCK:
+            total = ps.procesar_video(
+                upload_id, idioma=payload.get("idioma"), propagar=True, url=payload.get("url")
+            )
+        return {"subtitulos": total}
+    if tipo == "texto":
+        import procesar_texto as pt
+
+        pt.main(
+            upload_id,
+            propagar=True,
+            url=payload.get("url"),
+            file_name=payload.get("file_name"),
+            content_type=payload.get("content_type"),
+            tipo=payload.get("tipo"),
+        )
+        return {}
+    raise ValueError(f"Tipo de trabajo desconocido: {tipo}")
+
+
+def _terminar(conn, trabajo_id: int, resultado: dict):
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE trabajos
+               SET estado = 'completado', resultado = %s, terminado_en = now()
+             WHERE id = %s
+            """,
+            (json.dumps(resultado), trabajo_id),
+        )
+    conn.commit()
+
+
+def _fallar(conn, trabajo_id: int, intentos: int, max_intentos: int, error: str):
+    reintentar = intentos < max_intentos
+    espera = COLA_REINTENTO_BASE_S * 2 ** (intentos - 1)
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE trabajos
+               SET estado = %s,
+                   error = %s,
+                   disponible_en = now() + %s * interval '1 second',
+                   terminado_en = CASE WHEN %s THEN NULL ELSE now() END
+             WHERE id = %s
+            """,
+            ("pendiente" if reintentar else "error", error, espera, reintentar, trabajo_id),
+        )
+    conn.commit()
+    if reintentar:
+        print(f" Reintento {intentos + 1}/{max_intentos} del trabajo {trabajo_id} en {espera}s")
+
+
+class _Latido(threading.Thread):
+    # Mantiene latido_en al día mientras el trabajo corre; si el proceso muere,
+    # otro worker lo retoma pasado COLA_ABANDONO_S.
+    def __init__(self, trabajo_id: int):
+        super().__init__(daemon=True)
+        self.trabajo_id = trabajo_id
+        self.parar = threading.Event()
+
+    def run(self):
+        conn = None
+        try:
+            conn = _conectar()
+            while not self.parar.wait(COLA_LATIDO_S):
+                with conn.cursor() as cur:
+                    cur.execute("UPDATE trabajos SET latido_en = now() WHERE id = %s", (self.trabajo_id,))
+                conn.commit()
+        except Exception as e:
+            print(f" Aviso latido trabajo {self.trabajo_id}: {e}")
+        finally:
+            if conn:
+                conn.close()
+
+
+# ----------------- Costo estimado -----------------
+def _duracion_ffprobe(url: str) -> Optional[float]:
+    # Solo lee la cabecera del contenedor (por HTTP, unos pocos rangos)
+    import descargas
+
+    url = descargas.url_para_ffmpeg(url)  # ffprobe no codifica el path
+    try:
+        out = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", url],
+            capture_output=True,
+            text=True,
+            timeout=20,
+        ).stdout.strip()
+        return float(out) if out else None
+    except (OSError, ValueError, subprocess.TimeoutExpired):
+        return None
+
+
+def estimar_costo(tipo: str, size_bytes: Optional[int], url: Optional[str]) -> float:
+    if tipo == "subtitulos":
+        duracion = _duracion_ffprobe(url) if url else None
+        if duracion is None:
+            duracion = (size_bytes or 0) / COSTO_BYTES_POR_S_VIDEO
+        return duracion * COSTO_RTF_SUBTITULOS
+    return 1.0 + (size_bytes or 0) / COSTO_BYTES_POR_S_TEXTO
+
+
+def _estimar_pendientes(conn):
+    # Los trabajos encolados desde la web llegan sin costo: se completa aquí
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT t.id, t.tipo, u.size_in_bytes, COALESCE(t.payload->>'url', u.file_path)
+              FROM trabajos t
+              LEFT JOIN uploads u ON u.id = t.upload_id
+             WHERE t.estado = 'pendiente' AND t.costo IS NULL
+             ORDER BY t.id
+             LIMIT 50
+            """
+        )
+        filas = cur.fetchall()
+        for trabajo_id, tipo, size_bytes, url in filas:
+            costo = estimar_costo(tipo, size_bytes, url)
+            cur.execute("UPDATE trabajos SET costo = %s WHERE id = %s", (costo, trabajo_id))
+    return len(filas)
+
+
+# ----------------- Daemon -----------------
+def _tomar(conn, worker: str, carril: str):
+    # Primero los tipos propios del carril, después (si está ocioso) los demás
+    row = None
+    with conn.cursor() as cur:
+        for tipo in CARRILES[carril]:
+            cur.execute(
+                SQL_TOMAR,
+                {
+                    "worker": worker,
+                    "tipo": tipo,
+                    "abandono": COLA_ABANDONO_S,
+                    "bytes_por_s": (
+                        COSTO_BYTES_POR_S_VIDEO / COSTO_RTF_SUBTITULOS
+                        if tipo == "subtitulos"
+                        else COSTO_BYTES_POR_S_TEXTO
+                    ),
+                    "envejecimiento": COLA_ENVEJECIMIENTO,
+                },
+            )
+            row = cur.fetchone()
+            if row:
+                break
+    conn.commit()
+    return row
+
+
+def _esperar_aviso(conn, despertar: threading.Event):
+    # LISTEN en una conexión aparte: despierta a los hilos al encolar
+    with conn.cursor() as cur:
+        cur.execute(f"LISTEN {COLA_CANAL}")
+    while True:
+        if select.select([conn], [], [], COLA_SONDEO_S) != ([], [], []):
+            conn.poll()
+            if conn.notifies:
+                conn.notifies.clear()
+                despertar.set()
+        try:
+            if _estimar_pendientes(conn):
+                despertar.set()
+        except Exception as e:
+            print(f" Aviso estimación de costos: {e}")
+
+
+def _bucle_worker(nombre: str, carril: str, despertar: threading.Event, parar: threading.Event):
+    conn = _conectar()
+    try:
+        while not parar.is_set():
+            trabajo = _tomar(conn, nombre, carril)
+            if not trabajo:
+                despertar.wait(COLA_SONDEO_S)
+                despertar.clear()
+                continue
+
+            trabajo_id, upload_id, tipo, payload, intentos, max_intentos = trabajo
+            print(f" [{nombre}] Trabajo {trabajo_id}: {tipo} de {upload_id} (intento {intentos}/{max_intentos})")
+            latido = _Latido(trabajo_id)
+            latido.start()
+            t0 = time.perf_counter()
+            try:
+                resultado = _ejecutar(tipo, upload_id, payload or {})
+                resultado["segundos"] = round(time.perf_counter() - t0, 2)
+                _terminar(conn, trabajo_id, resultado)
+                print(f" [{nombre}] ✅ Trabajo {trabajo_id} completado en {resultado['segundos']}s")
+            except Exception as e:
+                print(f" [{nombre}] ❌ Trabajo {trabajo_id} falló: {e}")
+                traceback.print_exc()
+                _fallar(conn, trabajo_id, intentos, max_intentos, str(e) or type(e).__name__)
+            finally:
+                latido.parar.set()
+    finally:
+        conn.close()
+
+
+def run_daemon(workers: Dict[str, int] = COLA_WORKERS):
+    if workers.get("pesado", 0) > 1:
+        print(
+            f" Aviso: COLA_WORKERS_PESADO={workers['pesado']} no aplica: un solo hilo de subtítulos"
+            " por proceso (para más, levantar más réplicas del procesador)"
+        )
+        workers = dict(workers, pesado=1)
+    conn = _conectar()
+    asegurar_tablas(conn)
+    with conn.cursor() as cur:
+        cur.execute(SQL_CERRAR_ABANDONADOS, {"abandono": COLA_ABANDONO_S})
+    conn.commit()
+    conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+
+    despertar = threading.Event()
+    parar = threading.Event()
+    threading.Thread(target=_esperar_aviso, args=(conn, despertar), daemon=True).start()
+
+    host = socket.gethostname()
+    hilos = [
+        threading.Thread(
+            target=_bucle_worker,
+            args=(f"{host}:{os.getpid()}:{carril}{i}", carril, despertar, parar),
+            daemon=True,
+        )
+        for carril, n in workers.items()
+        for i in range(n)
+    ]
+    for h in hilos:
+        h.start()
+    resumen = ", ".join(f"{carril}={n}" for carril, n in workers.items())
+    print(f" Cola de trabajos escuchando con workers {resumen} (canal '{COLA_CANAL}')")
+    try:
+        while any(h.is_alive() for h in hilos):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print(" Deteniendo: se terminan los trabajos en curso...")
+        parar.set()
+        despertar.set()
+        for h in hilos:
+            h.join()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "encolar":
+        if len(sys.argv) < 4 or sys.argv[3] not in TIPOS:
+            print(" Uso: python cola_trabajos.py encolar <upload_id> subtitulos|texto")
+            sys.exit(1)
+        conn = _conectar()
+        asegurar_tablas(conn)
+        with conn.cursor() as cur:
+            cur.execute("SELECT size_in_bytes, file_path FROM uploads WHERE id = %s", (sys.argv[2],))
+            row = cur.fetchone() or (None, None)
+            trabajo_id = encolar(cur, sys.argv[2], sys.argv[3], costo=estimar_costo(sys.argv[3], *row))
+        conn.commit()
+        conn.close()
+        print(f" Trabajo encolado: {trabajo_id}" if trabajo_id else " Ya había un trabajo activo para ese upload")
+        sys.exit(0)
+    run_daemon()
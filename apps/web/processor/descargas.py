@@ -0,0 +1,146 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import requests
+
+# requests (~70 ms de import) se carga con la primera descarga
+
+# ----------------- Descargas HTTP compartidas -----------------
+# Una sola Session por proceso (keep-alive contra MinIO), lectura por bloques
+# configurables y, para archivos grandes, varios rangos HTTP en paralelo
+# escritos directo sobre un archivo preasignado. Cada rango reanuda desde el
+# último byte escrito si la conexión se corta.
+DESCARGA_CHUNK_BYTES = int(os.getenv("DESCARGA_CHUNK_KB", "1024")) * 1024
+DESCARGA_PARTES = max(1, int(os.getenv("DESCARGA_PARTES", "4")))
+DESCARGA_PARALELO_MIN_BYTES = int(os.getenv("DESCARGA_PARALELO_MIN_MB", "64")) * 1024 * 1024
+DESCARGA_REINTENTOS = int(os.getenv("DESCARGA_REINTENTOS", "3"))
+DESCARGA_TIMEOUT = (10, 60)  # (conexión, lectura) en segundos
+
+_sesion = None
+_sesion_lock = threading.Lock()
+
+
+def sesion() -> "requests.Session":
+    import requests  # type: ignore
+    from requests.adapters import HTTPAdapter  # type: ignore
+
+    global _sesion
+    with _sesion_lock:
+        if _sesion is None:
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(8, DESCARGA_PARTES * 2))
+            s.mount("http://", adapter)
+            s.mount("https://", adapter)
+            _sesion = s
+    return _sesion
+
+
+def url_para_ffmpeg(url: str) -> str:
+    # upload-minio arma publicUrl con el nombre original sin codificar
+    # (espacios, acentos). requests lo recodifica al pedir; ffmpeg/ffprobe
+    # mandan el path tal cual, así que se codifica igual que requests.
+    if not url.startswith(("http://", "https://")):
+        return url
+    from requests.utils import requote_uri  # type: ignore
+
+    return requote_uri(url)
+
+
+def _sondear(url: str) -> Tuple[Optional[int], bool]:
+    # (tamaño, acepta rangos). Un GET de 1 byte funciona aunque HEAD esté
+    # deshabilitado en URLs firmadas.
+    with sesion().get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=DESCARGA_TIMEOUT) as r:
+        if r.status_code == 416:  # archivo vacío
+            return 0, True
+        r.raise_for_status()
+        if r.status_code == 206:
+            rango = r.headers.get("Content-Range", "")  # bytes 0-0/12345
+            total = rango.rsplit("/", 1)[-1]
+            return (int(total) if total.isdigit() else None), True
+        largo = r.headers.get("Content-Length")
+        return (int(largo) if largo and largo.isdigit() else None), False
+
+
+def leer_rango(url: str, ini: int, fin: int) -> bytes:
+    # Bytes [ini, fin] en memoria (rangos chicos: cabecera, cola, huellas)
+    with sesion().get(url, headers={"Range": f"bytes={ini}-{fin}"}, timeout=DESCARGA_TIMEOUT) as r:
+        r.raise_for_status()
+        if r.status_code != 206:
+            raise IOError("El servidor no admite rangos")
+        return r.content
+
+
+def _bajar_rango(url: str, destino: str, ini: int, fin: Optional[int], chunk_bytes: int) -> int:
+    # Escribe [ini, fin] en su posición; ante un corte pide solo lo que falta
+    import requests  # type: ignore
+
+    escrito = 0
+    intentos = 0
+    while True:
+        desde = ini + escrito
+        if fin is not None and desde > fin:
+            return escrito
+        headers = {}
+        if desde > 0 or fin is not None:
+            headers["Range"] = f"bytes={desde}-{'' if fin is None else fin}"
+        antes = escrito
+        try:
+            with sesion().get(url, headers=headers, stream=True, timeout=DESCARGA_TIMEOUT) as r:
+                r.raise_for_status()
+                if headers and r.status_code != 206:
+                    if desde > 0:
+                        raise IOError("El servidor no admite rangos: no se puede reanudar")
+                with open(destino, "r+b") as f:
+                    f.seek(desde)
+                    for chunk in r.iter_content(chunk_bytes):
+                        if chunk:
+                            f.write(chunk)
+                            escrito += len(chunk)
+            if fin is None:
+                return escrito
+            if escrito == antes:
+                raise IOError(f"El servidor no devolvió datos para el rango {desde}-{fin}")
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            intentos += 1
+            if intentos > DESCARGA_REINTENTOS:
+                raise
+            print(f" Aviso descarga: conexión cortada en el byte {ini + escrito} ({e}); reanudando")
+            time.sleep(min(2**intentos, 10))
+
+
+def _rangos(total: int, partes: int) -> List[Tuple[int, int]]:
+    paso = -(-total // partes)
+    return [(i, min(i + paso, total) - 1) for i in range(0, total, paso)]
+
+
+def descargar(
+    url: str,
+    destino: str,
+    partes: Optional[int] = None,
+    chunk_bytes: Optional[int] = None,
+) -> int:
+    partes = partes or DESCARGA_PARTES
+    chunk_bytes = chunk_bytes or DESCARGA_CHUNK_BYTES
+    total, acepta_rangos = _sondear(url)
+
+    # archivo preasignado: cada rango escribe en su lugar sin reordenar
+    with open(destino, "wb") as f:
+        if total:
+            f.truncate(total)
+
+    if total and acepta_rangos and partes > 1 and total >= DESCARGA_PARALELO_MIN_BYTES:
+        rangos = _rangos(total, partes)
+        with ThreadPoolExecutor(max_workers=len(rangos)) as pool:
+            futuros = [pool.submit(_bajar_rango, url, destino, a, b, chunk_bytes) for a, b in rangos]
+            escrito = sum(f.result() for f in futuros)
+    else:
+        fin = total - 1 if total and acepta_rangos else None
+        escrito = _bajar_rango(url, destino, 0, fin, chunk_bytes)
+
+    if total is not None and (escrito != total or os.path.getsize(destino) != total):
+        raise IOError(f"Descarga incompleta: {escrito} de {total} bytes ({url})")
+    return escrito
@@ -0,0 +1,225 @@
+import os
+import time
+import hashlib
+import tempfile
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import descargas
+
+try:
+    import fcntl  # type: ignore
+except ImportError:  # Windows: sin locks, la caché funciona igual para un solo proceso
+    fcntl = None
+
+# ----------------- Caché local de medios -----------------
+# Los procesadores (subtítulos, texto, ...) trabajan sobre el mismo archivo de
+# MinIO: en vez de bajarlo y borrarlo cada uno, lo toman de este directorio.
+#  - Llenado atómico: se descarga a un .part y se publica con os.replace.
+#  - Un solo llenado por archivo: lock exclusivo mientras se descarga; el resto
+#    espera y después lo lee.
+#  - Lectores seguros: mientras un archivo está en uso se mantiene un lock
+#    compartido y la evicción lo salta.
+#  - Evicción LRU por tamaño total (mtime = último acceso) y, opcionalmente,
+#    por antigüedad. evictar() sirve también para otros directorios de caché
+#    (el PCM de subtítulos).
+MEDIA_CACHE_DIR = os.getenv(
+    "MEDIA_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "atomica_media_cache"),
+)
+MEDIA_CACHE_MAX_BYTES = int(float(os.getenv("MEDIA_CACHE_MAX_GB", "20")) * 1024**3)
+MEDIA_CACHE_PART_TTL_S = 24 * 3600  # .part huérfanos de procesos caídos
+HASH_CHUNK_BYTES = 1024 * 1024
+HUELLA_BYTES = 1024 * 1024  # primer y último MiB
+
+Descargador = Callable[[str, str], object]
+
+
+def ruta_en_cache(url: str, suffix: str = "") -> str:
+    # La clave ignora la query (URLs firmadas cambian en cada pedido)
+    base = url.split("?")[0].split("#")[0]
+    clave = hashlib.sha1(base.encode("utf-8")).hexdigest()
+    if not suffix:
+        suffix = os.path.splitext(base)[1].lower()
+    return os.path.join(MEDIA_CACHE_DIR, clave + suffix)
+
+
+@contextmanager
+def _lock(path: str, exclusivo: bool, bloquear: bool = True) -> Iterator[bool]:
+    if fcntl is None:
+        yield True
+        return
+    fd = os.open(path + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        modo = fcntl.LOCK_EX if exclusivo else fcntl.LOCK_SH
+        if not bloquear:
+            modo |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(fd, modo)
+        except BlockingIOError:
+            yield False
+            return
+        yield True
+    finally:
+        os.close(fd)  # libera el lock
+
+
+def _tocar(path: str):
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+
+def _llenar(url: str, path: str, descargar: Descargador):
+    with _lock(path, exclusivo=True):
+        if os.path.exists(path):
+            # otro proceso lo bajó mientras esperábamos
+            return
+        tmp = f"{path}.{os.getpid()}.part"
+        print(f" Descargando a la caché de medios: {url}")
+        t0 = time.perf_counter()
+        try:
+            descargar(url, tmp)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+        print(f" Archivo en caché: {path} ({os.path.getsize(path) / 1e6:.1f} MB en {time.perf_counter() - t0:.1f}s)")
+
+
+def _entradas(directorio: str) -> List[Tuple[float, int, str]]:
+    entradas = []
+    ahora = time.time()
+    if not os.path.isdir(directorio):
+        return entradas
+    for nombre in os.listdir(directorio):
+        path = os.path.join(directorio, nombre)
+        if nombre.endswith(".lock"):
+            continue
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if nombre.endswith(".part"):
+            if ahora - st.st_mtime > MEDIA_CACHE_PART_TTL_S:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            continue
+        entradas.append((st.st_mtime, st.st_size, path))
+    return entradas
+
+
+def evictar(
+    max_bytes: int = MEDIA_CACHE_MAX_BYTES,
+    conservar: Optional[str] = None,
+    directorio: Optional[str] = None,
+    max_edad_s: Optional[float] = None,
+) -> int:
+    # Borra los menos usados hasta quedar bajo max_bytes (y los no usados hace
+    # más de max_edad_s); nunca uno en uso
+    directorio = directorio or MEDIA_CACHE_DIR
+    entradas = sorted(_entradas(directorio))
+    total = sum(tam for _, tam, _ in entradas)
+    limite = time.time() - max_edad_s if max_edad_s else None
+    liberado = 0
+    for mtime, tam, path in entradas:
+        if total <= max_bytes and (limite is None or mtime >= limite):
+            break
+        if path == conservar:
+            continue
+        with _lock(path, exclusivo=True, bloquear=False) as libre:
+            if not libre:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+        try:
+            os.remove(path + ".lock")
+        except OSError:
+            pass
+        total -= tam
+        liberado += tam
+    if liberado:
+        print(f" Caché {directorio}: liberados {liberado / 1e6:.1f} MB")
+    return liberado
+
+
+@contextmanager
+def usar(path: str) -> Iterator[str]:
+    # Lock compartido sobre un archivo de caché propio (p. ej. el PCM de
+    # subtítulos) mientras se usa: evictar() no lo borra
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with _lock(path, exclusivo=False):
+        _tocar(path)
+        yield path
+
+
+def hash_media(path: str) -> Tuple[str, int]:
+    # sha256 del archivo original, leído por bloques (reuso por contenido)
+    h = hashlib.sha256()
+    total = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+            h.update(chunk)
+            total += len(chunk)
+    return h.hexdigest(), total
+
+
+def huella(url: str) -> Optional[Tuple[str, int]]:
+    # Clave barata de contenido: sha256 de (tamaño, primer MiB, último MiB).
+    # Sobre una URL son dos pedidos por rango, sin bajar el archivo; en un
+    # video el contenedor (cabecera, índice de muestras) cambia con cualquier
+    # edición. None si el servidor no da el tamaño o no admite rangos.
+    local = url if not url.startswith(("http://", "https://")) else ruta_en_cache(url)
+    if os.path.exists(local):
+        tam = os.path.getsize(local)
+        with open(local, "rb") as f:
+            cabeza = f.read(HUELLA_BYTES)
+            f.seek(max(len(cabeza), tam - HUELLA_BYTES))
+            cola = f.read()
+    elif local == url:
+        raise FileNotFoundError(url)
+    else:
+        tam, acepta_rangos = descargas._sondear(url)
+        if tam is None or not acepta_rangos:
+            return None
+        cabeza = descargas.leer_rango(url, 0, min(tam, HUELLA_BYTES) - 1) if tam else b""
+        desde = max(len(cabeza), tam - HUELLA_BYTES)
+        cola = descargas.leer_rango(url, desde, tam - 1) if desde < tam else b""
+    h = hashlib.sha256(f"{tam}\n".encode("ascii"))
+    h.update(cabeza)
+    h.update(cola)
+    return h.hexdigest(), tam
+
+
+def existe(url: str, suffix: str = "") -> bool:
+    return os.path.exists(ruta_en_cache(url, suffix))
+
+
+@contextmanager
+def abrir(url: str, suffix: str = "", descargar: Optional[Descargador] = None) -> Iterator[str]:
+    # Uso: with abrir(url, ".pdf") as path: ...  (no borrar el archivo)
+    # Rutas locales se devuelven tal cual.
+    if not url.startswith(("http://", "https://")):
+        yield url
+        return
+    os.makedirs(MEDIA_CACHE_DIR, exist_ok=True)
+    path = ruta_en_cache(url, suffix)
+    while True:
+        if not os.path.exists(path):
+            _llenar(url, path, descargar or descargas.descargar)
+            evictar(conservar=path)
+        with _lock(path, exclusivo=False):
+            # pudo ser evictado entre el llenado y el lock compartido
+            if not os.path.exists(path):
+                continue
+            _tocar(path)
+            yield path
+            return
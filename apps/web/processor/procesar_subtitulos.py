@@ -1,11 +1,24 @@
 import os
 import sys
-import math
+import json
+import time
+import socket
 import tempfile
+import threading
+import itertools
 import subprocess
-import requests
+import contextlib
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
 import psycopg2
-import whisper
+import psycopg2.extras
+
+# torch / whisper se importan recién al cargar el backend (varios segundos):
+# las invocaciones que terminan antes (upload inexistente, subtítulos ya
+# completos, caché por contenido) no los pagan.
+import descargas
+import media_cache
 
 # ===================== Config DB (nueva) =====================
 # Usa variables de entorno si existen, si no, usa los defaults
@@ -18,57 +31,1041 @@ DB_CONFIG = {
 }
 
 CHUNK_DURATION_MS = 15 * 1000  # 15 segundos por fragmento
+SAMPLE_RATE = 16000  # Whisper trabaja a 16 kHz mono
+
+# Streaming: descarga y decodificación en paralelo, sin archivo temporal.
+# SUBTITULOS_STREAMING=0 vuelve al modo descargar-y-luego-decodificar.
+STREAMING = os.getenv("SUBTITULOS_STREAMING", "1") != "0"
+STREAM_CHUNK_BYTES = 1024 * 64
+STREAM_SIN_SEEK = {".mkv", ".webm", ".ts"}  # contenedores legibles sin saltos
+
+# VAD por energía (SUBTITULOS_VAD=0 vuelve a las ventanas fijas de 15 s)
+VAD_ACTIVO = os.getenv("SUBTITULOS_VAD", "1") != "0"
+VAD_FRAME_MS = 30
+VAD_UMBRAL_DB = float(os.getenv("SUBTITULOS_VAD_UMBRAL_DB", "-50"))  # piso absoluto (dBFS)
+VAD_UMBRAL_MAX_DB = -30.0  # nunca exigir más que esto, aunque haya ruido de fondo
+VAD_MARGEN_DB = 10.0  # por encima del ruido de fondo estimado
+VAD_SILENCIO_MIN_S = 0.6  # pausas más cortas no separan regiones
+VAD_VOZ_MIN_S = 0.25  # golpes más cortos no cuentan como voz
+VAD_PADDING_S = 0.2
+VENTANA_MAX_S = 30.0  # contexto nativo de Whisper
+
+# Inferencia en lotes (CPU): varias ventanas de 30 s en una sola pasada del
+# encoder/decoder. SUBTITULOS_BATCH=1 usa model.transcribe ventana a ventana.
+BATCH_SIZE = max(1, int(os.getenv("SUBTITULOS_BATCH", "1")))
+NUM_HILOS = int(os.getenv("SUBTITULOS_HILOS", "0"))  # 0 = default de torch
+NO_SPEECH_UMBRAL = 0.6  # mismos umbrales que whisper.transcribe
+LOGPROB_UMBRAL = -1.0
+
+# Paralelismo por procesos para videos largos: el audio se parte en N rangos
+# contiguos (cortados en pausas) y cada proceso hijo transcribe el suyo. Los
+# pesos del modelo se comparten por memoria compartida (ver _init_hijo): van a
+# /dev/shm, que debe alcanzar para el modelo (en Docker, shm_size).
+NUM_PROCESOS = max(1, int(os.getenv("SUBTITULOS_PROCESOS", "1")))
+RANGO_MIN_S = 120.0  # rangos más cortos no compensan el costo del pool
+
+# Escritura en bloque: los segmentos se acumulan y se insertan con
+# execute_values; cada bloque se confirma para que el avance sea durable.
+INSERT_LOTE = int(os.getenv("SUBTITULOS_INSERT_LOTE", "500"))  # filas por bloque
+INSERT_INTERVALO_S = 5.0  # aunque no se llene el bloque, no esperar más que esto
+
+# Publicación incremental: cada bloque confirmado emite un NOTIFY en este canal
+# ({"video_id", "offset_s", "filas"}); con --jsonl además cada segmento sale
+# por stdout como una línea JSON apenas se transcribe.
+NOTIFY_CANAL = "video_subtitulos"
+
+# Reanudación: cada bloque confirmado guarda también hasta qué segundo quedó
+# transcrito (subtitulos_progreso). El audio decodificado se deja en disco
+# (PCM s16le) hasta que el trabajo termina, para no volver a descargarlo; en
+# streaming también el prefijo ya decodificado si el trabajo falla a mitad.
+CACHE_DIR = os.getenv(
+    "SUBTITULOS_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "atomica_subtitulos_cache"),
+)
+# Los PCM de trabajos que no se reanudan no se borran solos: el directorio se
+# acota por tamaño (LRU) y por antigüedad con la evicción de media_cache.
+CACHE_MAX_BYTES = int(float(os.getenv("SUBTITULOS_CACHE_MAX_GB", "10")) * 1024**3)
+CACHE_TTL_S = float(os.getenv("SUBTITULOS_CACHE_TTL_H", "72")) * 3600
+
+# Caché por contenido: el mismo archivo subido con otro uploads.id reutiliza
+# los subtítulos ya generados. La búsqueda usa una huella barata (tamaño +
+# primer y último MiB, media_cache.huella) que no baja el archivo: si no hay
+# coincidencia el audio sigue por streaming como siempre.
+DEDUP_ACTIVO = os.getenv("SUBTITULOS_DEDUP", "1") != "0"
+
+# ===================== Config worker persistente =====================
+# El worker carga el modelo una sola vez y atiende video_ids por un socket UNIX.
+# La CLI (`procesar_subtitulos.py <video_id>`) le delega el trabajo si está vivo
+# y, si no, procesa en el mismo proceso como siempre.
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "medium")
+# Motor ASR: "whisper" (openai-whisper, torch) o "ct2" (faster-whisper,
+# CTranslate2 cuantizado int8 en CPU). Ambos producen los mismos (inicio, fin, texto).
+ASR_BACKEND = os.getenv("SUBTITULOS_BACKEND", "whisper").lower()
+CT2_COMPUTE_TYPE = os.getenv("SUBTITULOS_CT2_COMPUTE", "int8")
+
+# Idioma: se detecta una vez por video (sobre las ventanas con más voz del
+# comienzo) y se guarda en video_idiomas. SUBTITULOS_IDIOMA=es lo fuerza;
+# SUBTITULOS_IDIOMA=multi vuelve a detectar por ventana (contenido multilingüe).
+IDIOMA_FORZADO = os.getenv("SUBTITULOS_IDIOMA") or None
+IDIOMA_MULTI = "multi"
+IDIOMA_VENTANAS_MUESTRA = 6  # ventanas iniciales entre las que se elige
+IDIOMA_VENTANAS_DETECCION = 3  # cuántas se usan para detectar
+SOCKET_PATH = os.getenv(
+    "SUBTITULOS_SOCKET",
+    os.path.join(tempfile.gettempdir(), "atomica_subtitulos.sock"),
+)
+
+_model = None
+_model_lock = threading.Lock()  # varios hilos (cola de trabajos) no cargan dos copias
+
+
+def get_model(backend: Optional[str] = None):
+    # 🔹 Modelo "medium" para mejor precisión (cargado una vez por proceso)
+    global _model
+    nombre = (backend or ASR_BACKEND).lower()
+    if _model is not None and _model.nombre == nombre:
+        return _model
+    with _model_lock:
+        if _model is None or _model.nombre != nombre:
+            if nombre not in BACKENDS:
+                raise ValueError(f"Backend ASR desconocido: {nombre} (opciones: {', '.join(BACKENDS)})")
+            print(f" Cargando modelo '{WHISPER_MODEL}' con backend {nombre}...")
+            t0 = time.perf_counter()
+            _model = BACKENDS[nombre](WHISPER_MODEL)
+            print(f" Modelo listo en {time.perf_counter() - t0:.1f}s")
+        return _model
 
 
-def download_to_temp(url: str, suffix: str = ".mkv") -> str:
-    print(" Descargando el archivo del servidor...")
-    with requests.get(url, stream=True, timeout=60) as r:
-        r.raise_for_status()
-        fd, tmp_path = tempfile.mkstemp(suffix=suffix)
-        with os.fdopen(fd, "wb") as f:
-            for chunk in r.iter_content(1024 * 64):
-                f.write(chunk)
-    print(f" Archivo guardado temporalmente en: {tmp_path}")
-    return tmp_path
-
-
-def convert_to_wav(input_path: str) -> str:
-    # soporta .mkv, .mp4, etc.
-    base, _ = os.path.splitext(input_path)
-    wav_path = base + ".wav"
-    print(" Convirtiendo a WAV...")
-    subprocess.run(
-        [
-            "ffmpeg",
-            "-y",
-            "-i",
-            input_path,
-            "-vn",
-            "-acodec",
-            "pcm_s16le",
-            "-ar",
-            "16000",
-            "-ac",
-            "1",
-            wav_path,
-        ],
+def _ffmpeg_pcm_cmd(input_spec: str, inicio_s: float = 0.0) -> list:
+    # PCM mono 16 kHz por stdout (soporta .mkv, .mp4, etc.)
+    # Sobre un pipe no se puede saltar: -ss va como opción de salida (decodifica
+    # y descarta hasta inicio_s); sobre archivo/URL salta por el índice.
+    seek = ["-ss", f"{inicio_s:.3f}"] if inicio_s > 0 else []
+    en_pipe = input_spec.startswith("pipe:")
+    return [
+        "ffmpeg",
+        "-nostdin",
+        *([] if en_pipe else seek),
+        "-i",
+        input_spec,
+        *(seek if en_pipe else []),
+        "-vn",
+        "-f",
+        "s16le",
+        "-acodec",
+        "pcm_s16le",
+        "-ar",
+        str(SAMPLE_RATE),
+        "-ac",
+        "1",
+        "-",
+    ]
+
+
+def _pcm_to_float32(raw: bytes) -> np.ndarray:
+    return np.frombuffer(raw, np.int16).astype(np.float32) / 32768.0
+
+
+def _ruta_cache_pcm(video_id: str) -> str:
+    return os.path.join(CACHE_DIR, f"{video_id}.s16le")
+
+
+def _escribir_atomico(path: str, raw: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.part"
+    with open(tmp, "wb") as f:
+        f.write(raw)
+    os.replace(tmp, path)
+
+
+def cargar_pcm_cache(path: str) -> Optional[np.ndarray]:
+    if not os.path.exists(path):
+        return None
+    print(f" Usando audio decodificado en caché: {path}")
+    return np.fromfile(path, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+def decode_audio(input_path: str, cache_path: Optional[str] = None) -> np.ndarray:
+    # Una sola pasada de ffmpeg, directo a memoria.
+    # Sin WAV intermedio ni archivos por fragmento.
+    print(" Decodificando audio...")
+    proc = subprocess.run(
+        _ffmpeg_pcm_cmd(input_path),
         check=True,
-        stdout=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
         stderr=subprocess.DEVNULL,
     )
-    print(f" Archivo WAV listo: {wav_path}")
-    return wav_path
+    if cache_path:
+        _escribir_atomico(cache_path, proc.stdout)
+    audio = _pcm_to_float32(proc.stdout)
+    print(f" Audio listo: {len(audio) / SAMPLE_RATE:.2f} seg en memoria")
+    return audio
+
+
+def _chunk_samples() -> int:
+    return CHUNK_DURATION_MS * SAMPLE_RATE // 1000
+
+
+def fragmentos_fijos(
+    bloques: Iterable[np.ndarray], inicio_s: float = 0.0
+) -> Iterator[Tuple[float, np.ndarray]]:
+    # Ventanas ciegas de CHUNK_DURATION_MS (modo sin VAD)
+    chunk_samples = _chunk_samples()
+    base = 0
+    for bloque in bloques:
+        for offset in range(0, len(bloque), chunk_samples):
+            # slice de numpy = vista sobre el mismo buffer, sin copia
+            yield inicio_s + (base + offset) / SAMPLE_RATE, bloque[offset : offset + chunk_samples]
+        base += len(bloque)
+
+
+def _alimentar_stdin(url: str, stdin, errores: list):
+    # Hilo productor: cuerpo HTTP -> stdin de ffmpeg, sin tocar disco. Si la
+    # conexión se corta se pide por rango lo que falta (como descargas._bajar_rango)
+    import requests  # type: ignore
+
+    enviado = 0
+    intentos = 0
+    try:
+        while True:
+            headers = {"Range": f"bytes={enviado}-"} if enviado else {}
+            antes = enviado
+            try:
+                with descargas.sesion().get(
+                    url, headers=headers, stream=True, timeout=descargas.DESCARGA_TIMEOUT
+                ) as r:
+                    r.raise_for_status()
+                    if headers and r.status_code != 206:
+                        raise IOError("El servidor no admite rangos: no se puede reanudar")
+                    for chunk in r.iter_content(STREAM_CHUNK_BYTES):
+                        if chunk:
+                            stdin.write(chunk)
+                            enviado += len(chunk)
+                return
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                intentos = 0 if enviado > antes else intentos + 1
+                if intentos > descargas.DESCARGA_REINTENTOS:
+                    raise
+                print(f" Aviso streaming: conexión cortada en el byte {enviado} ({e}); reanudando")
+                time.sleep(min(2 ** max(intentos, 1), 10))
+    except BrokenPipeError:
+        # ffmpeg terminó antes (error de formato o el consumidor se detuvo)
+        pass
+    except Exception as e:
+        errores.append(e)
+    finally:
+        try:
+            stdin.close()
+        except OSError:
+            pass
+
+
+def _ruta_parcial(cache_path: str) -> str:
+    # PCM desde 0 s mientras se decodifica; si el trabajo falla queda en disco
+    # y la próxima corrida sigue desde donde llegó
+    return cache_path + ".parcial"
+
+
+def _decodificar_a_parcial(url: str, por_stdin: bool, parcial: str, estado: dict):
+    # Hilo productor: ffmpeg a toda velocidad, agregando al PCM parcial. No
+    # depende del ritmo de la transcripción (que lee detrás).
+    cond = estado["cond"]
+    errores: list = []
+    feeder = None
+    proc = None
+    try:
+        with open(parcial, "ab") as f:
+            desde_s = f.tell() / 2 / SAMPLE_RATE
+            proc = subprocess.Popen(
+                _ffmpeg_pcm_cmd("pipe:0" if por_stdin else descargas.url_para_ffmpeg(url), desde_s),
+                stdin=subprocess.PIPE if por_stdin else subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+            estado["proc"] = proc
+            if por_stdin:
+                feeder = threading.Thread(
+                    target=_alimentar_stdin, args=(url, proc.stdin, errores), daemon=True
+                )
+                feeder.start()
+            for raw in iter(lambda: proc.stdout.read(STREAM_CHUNK_BYTES), b""):
+                if estado["parar"]:
+                    break
+                f.write(raw)
+                f.flush()
+                with cond:
+                    estado["escrito"] = f.tell()
+                    cond.notify_all()
+        if estado["parar"]:
+            return  # el feeder (daemon) termina solo al cerrarse el pipe
+        if feeder:
+            feeder.join()
+        if errores:
+            raise errores[0]
+        if proc.wait() != 0:
+            raise subprocess.CalledProcessError(proc.returncode, "ffmpeg")
+        estado["completo"] = True
+    except Exception as e:
+        estado["error"] = e
+    finally:
+        if proc and proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        with cond:
+            estado["fin"] = True
+            cond.notify_all()
+
+
+def stream_audio(url: str, inicio_s: float, cache_path: str) -> Iterator[np.ndarray]:
+    # Descarga y decodificación solapadas con la transcripción: ffmpeg escribe
+    # el PCM en <cache>.parcial a toda velocidad y los fragmentos se leen
+    # detrás, en cuanto están escritos.
+    #  - .mkv/.webm/.ts se leen secuencialmente: el cuerpo de requests va al stdin.
+    #  - .mp4/.mov/... pueden tener el índice (moov) al final y ffmpeg necesita
+    #    saltar: se le pasa la URL y lee por rangos HTTP.
+    # Si quedó un parcial de una corrida anterior, ffmpeg salta hasta su final
+    # (por rangos HTTP eso evita volver a bajar lo ya decodificado). Al
+    # terminar la decodificación el parcial pasa a ser la caché completa.
+    ext = os.path.splitext(url.split("?")[0].split("#")[0])[1].lower()
+    por_stdin = ext in STREAM_SIN_SEEK
+    parcial = _ruta_parcial(cache_path)
+    os.makedirs(os.path.dirname(parcial), exist_ok=True)
+    with open(parcial, "ab") as f:
+        # prefijo válido: segundos enteros (un corte pudo dejar media muestra)
+        prefijo = f.tell() // (2 * SAMPLE_RATE) * (2 * SAMPLE_RATE)
+        f.truncate(prefijo)
+    if prefijo:
+        print(f" Retomando audio decodificado: {prefijo / 2 / SAMPLE_RATE:.0f}s ya en {parcial}")
+    print(f" Descargando y decodificando en streaming ({'stdin' if por_stdin else 'rangos HTTP'})...")
+
+    estado = {
+        "cond": threading.Condition(),
+        "escrito": prefijo,
+        "fin": False,
+        "parar": False,
+        "completo": False,
+        "error": None,
+        "proc": None,
+    }
+    productor = threading.Thread(
+        target=_decodificar_a_parcial, args=(url, por_stdin, parcial, estado), daemon=True
+    )
+    productor.start()
+
+    chunk_bytes = _chunk_samples() * 2  # s16le = 2 bytes por muestra
+    pos = int(inicio_s * SAMPLE_RATE) * 2
+    cond = estado["cond"]
+    try:
+        with open(parcial, "rb") as lector:
+            while True:
+                with cond:
+                    while estado["escrito"] - pos < chunk_bytes and not estado["fin"]:
+                        cond.wait(1.0)
+                    disponible = estado["escrito"] - pos
+                    fin = estado["fin"]
+                n = min(chunk_bytes, disponible) // 2 * 2
+                if n <= 0:
+                    if fin:
+                        break
+                    continue
+                lector.seek(pos)
+                raw = lector.read(n)
+                pos += len(raw)
+                yield _pcm_to_float32(raw)
+        productor.join()
+        if estado["error"] is not None:
+            raise estado["error"]
+    finally:
+        if productor.is_alive():
+            # el consumidor se detuvo (error o cancelación): el parcial queda
+            estado["parar"] = True
+            proc = estado["proc"]
+            if proc and proc.poll() is None:
+                proc.kill()
+            productor.join()
+        if estado["completo"]:
+            os.replace(parcial, cache_path)
+
+
+# ===================== VAD (detección de voz por energía) =====================
+# En vez de cortar cada 15 s a ciegas, se detectan las regiones con voz, se
+# descarta el silencio y se agrupan en ventanas de hasta ~30 s (lo que Whisper
+# procesa en una pasada), cortando siempre en pausas.
+def _frame_samples() -> int:
+    return SAMPLE_RATE * VAD_FRAME_MS // 1000
+
+
+def _energia_db(audio: np.ndarray) -> np.ndarray:
+    frame = _frame_samples()
+    n = len(audio) // frame
+    if n == 0:
+        return np.zeros(0, np.float32)
+    frames = audio[: n * frame].reshape(n, frame)
+    rms = np.sqrt(np.mean(frames * frames, axis=1) + 1e-10)
+    return 20 * np.log10(rms)
+
+
+def regiones_de_voz(audio: np.ndarray) -> List[Tuple[int, int]]:
+    # (inicio, fin) en muestras de cada región con voz, ya con padding
+    db = _energia_db(audio)
+    if not len(db):
+        return []
+    # umbral adaptativo: ruido de fondo estimado + margen, acotado
+    umbral = float(np.percentile(db, 10)) + VAD_MARGEN_DB
+    umbral = min(max(umbral, VAD_UMBRAL_DB), VAD_UMBRAL_MAX_DB)
+    voz = db > umbral
+
+    frame = _frame_samples()
+    cambios = np.flatnonzero(np.diff(voz.astype(np.int8))) + 1
+    bordes = np.concatenate(([0], cambios, [len(voz)]))
+
+    silencio_min = int(VAD_SILENCIO_MIN_S * SAMPLE_RATE)
+    regiones: List[List[int]] = []
+    for ini, fin in zip(bordes[:-1], bordes[1:]):
+        if not voz[ini]:
+            continue
+        a, b = int(ini) * frame, int(fin) * frame
+        if regiones and a - regiones[-1][1] < silencio_min:
+            regiones[-1][1] = b  # pausa corta: misma región
+        else:
+            regiones.append([a, b])
+
+    voz_min = int(VAD_VOZ_MIN_S * SAMPLE_RATE)
+    pad = int(VAD_PADDING_S * SAMPLE_RATE)
+    return [
+        (max(0, a - pad), min(len(audio), b + pad))
+        for a, b in regiones
+        if b - a >= voz_min
+    ]
+
+
+def _corte_en_pausa(db: np.ndarray, ini: int, limite: int, margen_s: float = 2.0) -> int:
+    # Punto más silencioso en los últimos `margen_s` antes de `limite` (en muestras)
+    frame = _frame_samples()
+    f_hi = min(limite // frame, len(db))
+    f_lo = max(ini // frame + 1, f_hi - int(margen_s * SAMPLE_RATE) // frame)
+    if f_lo >= f_hi:
+        return limite
+    return int(f_lo + np.argmin(db[f_lo:f_hi])) * frame
+
+
+def empaquetar_ventanas(audio: np.ndarray) -> List[Tuple[int, int]]:
+    # Junta regiones de voz consecutivas en ventanas de hasta VENTANA_MAX_S
+    max_samples = int(VENTANA_MAX_S * SAMPLE_RATE)
+    db = None
+    ventanas: List[Tuple[int, int]] = []
+    for a, b in regiones_de_voz(audio):
+        while b - a > max_samples:
+            # voz continua de más de 30 s: se corta en la pausa más cercana
+            if db is None:
+                db = _energia_db(audio)
+            corte = _corte_en_pausa(db, a, a + max_samples)
+            ventanas.append((a, corte))
+            a = corte
+        if ventanas and b - ventanas[-1][0] <= max_samples:
+            ventanas[-1] = (ventanas[-1][0], b)
+        else:
+            ventanas.append((a, b))
+    return ventanas
+
+
+def segmentar_por_voz(
+    bloques: Iterable[np.ndarray], inicio_s: float = 0.0
+) -> Iterator[Tuple[float, np.ndarray]]:
+    # Funciona igual sobre el audio completo en memoria o sobre bloques en
+    # streaming: se retiene una cola de VENTANA_MAX_S para no partir una
+    # región de voz que sigue en el bloque siguiente.
+    max_samples = int(VENTANA_MAX_S * SAMPLE_RATE)
+    buffer = np.zeros(0, np.float32)
+    base = 0  # muestra absoluta de buffer[0]
+    total = 0
+    con_voz = 0
+
+    for bloque in bloques:
+        total += len(bloque)
+        buffer = bloque if not len(buffer) else np.concatenate((buffer, bloque))
+        if len(buffer) < 2 * max_samples:
+            continue
+
+        limite = len(buffer) - max_samples
+        corte = limite
+        for a, b in empaquetar_ventanas(buffer):
+            if b > limite:
+                corte = min(a, limite)
+                break
+            con_voz += b - a
+            yield inicio_s + (base + a) / SAMPLE_RATE, buffer[a:b]
+            corte = b
+        buffer = buffer[corte:]
+        base += corte
+
+    for a, b in empaquetar_ventanas(buffer):
+        con_voz += b - a
+        yield inicio_s + (base + a) / SAMPLE_RATE, buffer[a:b]
+
+    if total:
+        omitido = total - con_voz
+        print(
+            f" VAD: {con_voz / SAMPLE_RATE:.1f}s con voz de {total / SAMPLE_RATE:.1f}s; "
+            f"omitidos {omitido / SAMPLE_RATE:.1f}s ({100 * omitido / total:.1f}%)"
+        )
+
+
+def ventanas_de_audio(
+    bloques: Iterable[np.ndarray], inicio_s: float = 0.0
+) -> Iterator[Tuple[float, np.ndarray]]:
+    if VAD_ACTIVO:
+        return segmentar_por_voz(bloques, inicio_s)
+    return fragmentos_fijos(bloques, inicio_s)
+
+
+# ===================== Backends ASR =====================
+# Interfaz común: transcribir(chunk) y transcribir_lote(chunks) devuelven
+# segmentos (inicio, fin, texto) relativos al inicio de cada chunk.
+Segmento = Tuple[float, float, str]
+
+
+class AsrBackend:
+    nombre = ""
+    admite_procesos = False  # ¿se puede pasar a un pool de procesos (pesos compartidos)?
+
+    def transcribir(self, chunk: np.ndarray, idioma: Optional[str] = None) -> List[Segmento]:
+        raise NotImplementedError
+
+    def transcribir_lote(
+        self, chunks: List[np.ndarray], idioma: Optional[str] = None
+    ) -> List[List[Segmento]]:
+        return [self.transcribir(c, idioma) for c in chunks]
+
+    def detectar_idioma(self, chunks: List[np.ndarray]) -> Tuple[str, float]:
+        # Promedia las probabilidades de idioma de varias ventanas
+        raise NotImplementedError
+
+    def compartir(self):
+        # Deja los pesos en memoria compartida antes de mandarlo a los hijos
+        pass
+
+
+def _mejor_idioma(probs_por_ventana: List[dict]) -> Tuple[str, float]:
+    total: dict = {}
+    for probs in probs_por_ventana:
+        for lang, p in probs.items():
+            total[lang] = total.get(lang, 0.0) + p
+    lang = max(total, key=total.get)
+    return lang, total[lang] / len(probs_por_ventana)
+
+
+def _segmentos_de_tokens(tokens, tokenizer, duracion: float) -> List[Segmento]:
+    # Reconstruye (inicio, fin, texto) a partir de los tokens de timestamp
+    # (<|t0|> texto <|t1|><|t1|> texto <|t2|> ...), como hace whisper.transcribe
+    ts_begin = tokenizer.timestamp_begin
+    segs = []
+    inicio = None
+    texto: List[int] = []
+    for tok in tokens:
+        if tok >= ts_begin:
+            t = (tok - ts_begin) * 0.02
+            if inicio is not None and texto:
+                segs.append((inicio, t, tokenizer.decode(texto)))
+                texto = []
+                inicio = None
+            else:
+                inicio = t
+        elif tok < tokenizer.eot:
+            texto.append(tok)
+    if texto:
+        segs.append((inicio or 0.0, duracion, tokenizer.decode(texto)))
+    return segs
+
+
+class WhisperBackend(AsrBackend):
+    nombre = "whisper"
+    admite_procesos = True
+
+    def __init__(self, modelo: str):
+        import torch  # type: ignore
+        import whisper  # type: ignore
+
+        if NUM_HILOS > 0:
+            torch.set_num_threads(NUM_HILOS)
+        self.model = whisper.load_model(modelo)
+
+    def _mels(self, chunks: List[np.ndarray]):
+        import torch  # type: ignore
+        import whisper  # type: ignore
+
+        model = self.model
+        return torch.stack(
+            [
+                whisper.log_mel_spectrogram(whisper.pad_or_trim(torch.from_numpy(chunk)), model.dims.n_mels)
+                for chunk in chunks
+            ]
+        ).to(model.device)
+
+    def transcribir(self, chunk: np.ndarray, idioma: Optional[str] = None) -> List[Segmento]:
+        result = self.model.transcribe(
+            chunk,
+            fp16=False,
+            task="transcribe",  # 🔹 Solo transcribir, sin traducir
+            language=idioma,    # 🔹 None = auto-detectar en esta ventana
+        )
+        return [(seg["start"], seg["end"], seg.get("text") or "") for seg in result.get("segments", [])]
+
+    def transcribir_lote(
+        self, chunks: List[np.ndarray], idioma: Optional[str] = None
+    ) -> List[List[Segmento]]:
+        # Un solo forward del encoder y un decoder batched para todo el lote
+        import whisper  # type: ignore
+
+        model = self.model
+        opciones = whisper.DecodingOptions(task="transcribe", language=idioma, fp16=False)
+        resultados = whisper.decode(model, self._mels(chunks), opciones)
+        tokenizer = whisper.tokenizer.get_tokenizer(
+            model.is_multilingual, num_languages=model.num_languages
+        )
+
+        salida = []
+        for chunk, res in zip(chunks, resultados):
+            if res.no_speech_prob > NO_SPEECH_UMBRAL and res.avg_logprob < LOGPROB_UMBRAL:
+                salida.append([])  # ventana sin voz: mismo criterio que whisper.transcribe
+            else:
+                salida.append(_segmentos_de_tokens(res.tokens, tokenizer, len(chunk) / SAMPLE_RATE))
+        return salida
+
+    def detectar_idioma(self, chunks: List[np.ndarray]) -> Tuple[str, float]:
+        import torch  # type: ignore
+
+        with torch.no_grad():
+            _, probs = self.model.detect_language(self._mels(chunks))
+        return _mejor_idioma(probs)
+
+    def compartir(self):
+        # in-place y una sola vez: los hijos reciben handles, no una copia.
+        # alignment_heads es un buffer sparse (no admite share_memory_) y
+        # chico: ese viaja copiado.
+        for t in itertools.chain(self.model.parameters(), self.model.buffers()):
+            if not t.is_sparse:
+                t.share_memory_()
+
+
+class Ct2Backend(AsrBackend):
+    # faster-whisper: mismos pesos de Whisper convertidos a CTranslate2 y
+    # cuantizados (int8 por defecto). Decodificación greedy, igual que
+    # whisper.transcribe, para que la salida sea comparable.
+    nombre = "ct2"
+
+    def __init__(self, modelo: str):
+        from faster_whisper import WhisperModel  # type: ignore
+
+        self.model = WhisperModel(
+            modelo,
+            device="cpu",
+            compute_type=CT2_COMPUTE_TYPE,
+            cpu_threads=NUM_HILOS,
+        )
+
+    def transcribir(self, chunk: np.ndarray, idioma: Optional[str] = None) -> List[Segmento]:
+        segments, _info = self.model.transcribe(
+            chunk,
+            task="transcribe",
+            language=idioma,
+            beam_size=1,
+            vad_filter=False,  # el VAD ya se aplicó al armar las ventanas
+        )
+        return [(seg.start, seg.end, seg.text) for seg in segments]
+
+    def detectar_idioma(self, chunks: List[np.ndarray]) -> Tuple[str, float]:
+        probs = []
+        for chunk in chunks:
+            # los segmentos son perezosos: solo corre la detección de idioma
+            _, info = self.model.transcribe(chunk, language=None, beam_size=1, vad_filter=False)
+            probs.append(dict(info.all_language_probs or [(info.language, info.language_probability)]))
+        return _mejor_idioma(probs)
+
+
+BACKENDS = {
+    WhisperBackend.nombre: WhisperBackend,
+    Ct2Backend.nombre: Ct2Backend,
+}
+
+
+def detectar_idioma(
+    model: AsrBackend, ventanas: Iterable[Tuple[float, np.ndarray]]
+) -> Tuple[Optional[str], float, Iterator[Tuple[float, np.ndarray]]]:
+    # Mira las primeras ventanas, detecta con las que tienen más voz y devuelve
+    # un iterador que vuelve a entregar todas (sirve también en streaming)
+    ventanas = iter(ventanas)
+    muestra = list(itertools.islice(ventanas, IDIOMA_VENTANAS_MUESTRA))
+    resto = itertools.chain(muestra, ventanas)
+    if not muestra:
+        return None, 0.0, resto
+
+    elegidas = sorted(muestra, key=lambda v: len(v[1]), reverse=True)[:IDIOMA_VENTANAS_DETECCION]
+    t0 = time.perf_counter()
+    idioma, prob = model.detectar_idioma([c for _, c in elegidas])
+    print(
+        f" Idioma detectado: {idioma} (p={prob:.2f}, {len(elegidas)} ventanas, "
+        f"{time.perf_counter() - t0:.1f}s)"
+    )
+    return idioma, prob, resto
+
+
+# Cada resultado es (avance_s, segmentos): hasta qué segundo del audio quedó
+# transcrito y los segmentos de esa ventana con tiempos absolutos. El avance
+# es lo que se guarda como checkpoint.
+Resultado = Tuple[float, List[Segmento]]
+
+
+def transcribir_ventanas(
+    model: AsrBackend,
+    fragmentos: Iterable[Tuple[float, np.ndarray]],
+    idioma: Optional[str] = None,
+) -> Iterator[Resultado]:
+    fragmentos = iter(fragmentos)
+    i = 0
+    while True:
+        lote = list(itertools.islice(fragmentos, BATCH_SIZE))
+        if not lote:
+            break
+        i += len(lote)
+        start_sec, chunk = lote[0]
+        if len(lote) == 1:
+            print(f" Fragmento {i} (inicio: {start_sec:.1f}s, {len(chunk) / SAMPLE_RATE:.1f}s)")
+            resultados = [model.transcribir(chunk, idioma)]
+        else:
+            print(f" Fragmentos hasta {i} (lote de {len(lote)}, inicio: {start_sec:.1f}s)")
+            resultados = model.transcribir_lote([c for _, c in lote], idioma)
+
+        for (start_sec, chunk), segs in zip(lote, resultados):
+            limpios = []
+            for ini, fin, text in segs:
+                text = (text or "").strip()
+                if text:
+                    limpios.append((ini + start_sec, fin + start_sec, text))
+            yield start_sec + len(chunk) / SAMPLE_RATE, limpios
+
+
+def transcribir_fragmentos(
+    model: AsrBackend,
+    fragmentos: Iterable[Tuple[float, np.ndarray]],
+    idioma: Optional[str] = None,
+) -> Iterator[Segmento]:
+    # Devuelve (inicio, fin, texto) con tiempos absolutos, fragmento a fragmento
+    for _, segs in transcribir_ventanas(model, fragmentos, idioma):
+        yield from segs
+
+
+# ===================== Pool de procesos por rangos =====================
+# Los hijos arrancan con forkserver/spawn, no con fork: el padre ya usó torch
+# (carga del modelo, detección de idioma) y puede ser un daemon con hilos, y
+# libgomp (OpenMP de torch) no sobrevive a un fork en ese estado. El modelo
+# viaja en initargs con los pesos en memoria compartida (torch.multiprocessing)
+# y cada hijo recibe solo su rango de audio.
+_estado_pool = None  # (model, idioma) en cada hijo
+
+
+def _rangos_en_pausas(audio: np.ndarray, n: int) -> List[Tuple[int, int]]:
+    db = _energia_db(audio)
+    paso = len(audio) // n
+    cortes = [0]
+    for k in range(1, n):
+        cortes.append(_corte_en_pausa(db, cortes[-1], k * paso, margen_s=10.0))
+    cortes.append(len(audio))
+    return [(a, b) for a, b in zip(cortes[:-1], cortes[1:]) if b > a]
+
+
+def _init_hijo(hilos: int, model: AsrBackend, idioma: Optional[str]):
+    import torch  # type: ignore
+
+    global _estado_pool
+    torch.set_num_threads(hilos)
+    _estado_pool = (model, idioma)
+
+
+def _transcribir_rango(tarea: Tuple[float, float, np.ndarray]) -> Resultado:
+    model, idioma = _estado_pool
+    inicio_s, fin_s, audio = tarea
+    segs = list(transcribir_fragmentos(model, ventanas_de_audio([audio], inicio_s), idioma))
+    return fin_s, segs
+
+
+def transcribir_en_paralelo(
+    model: AsrBackend,
+    audio: np.ndarray,
+    procesos: int,
+    idioma: Optional[str] = None,
+    inicio_s: float = 0.0,
+) -> Iterator[Resultado]:
+    import torch.multiprocessing as tmp  # type: ignore  # registra el pickling por memoria compartida
+
+    rangos = _rangos_en_pausas(audio, procesos)
+    hilos = NUM_HILOS or max(1, (os.cpu_count() or 1) // len(rangos))
+    metodo = "forkserver" if "forkserver" in tmp.get_all_start_methods() else "spawn"
+    print(f" Transcribiendo en {len(rangos)} procesos ({hilos} hilos c/u, {metodo})")
+
+    model.compartir()
+    tareas = [(inicio_s + a / SAMPLE_RATE, inicio_s + b / SAMPLE_RATE, audio[a:b]) for a, b in rangos]
+    ctx = tmp.get_context(metodo)
+    with ctx.Pool(len(rangos), initializer=_init_hijo, initargs=(hilos, model, idioma)) as pool:
+        # imap respeta el orden de los rangos: los tiempos salen ordenados
+        # y el checkpoint avanza rango a rango
+        yield from pool.imap(_transcribir_rango, tareas)
+
+
+def transcribir_audio(
+    model: AsrBackend, audio: np.ndarray, idioma: Optional[str] = None, inicio_s: float = 0.0
+) -> Iterator[Resultado]:
+    # `audio` empieza en inicio_s (al reanudar, lo que falta por transcribir)
+    if not len(audio) and inicio_s <= 0:
+        raise ValueError("Duración del audio inválida")
+    duracion = len(audio) / SAMPLE_RATE
+    print(f" Duración: {duracion:.2f} seg" + (f" (desde {inicio_s:.1f}s)" if inicio_s > 0 else ""))
+
+    procesos = min(NUM_PROCESOS, int(duracion // RANGO_MIN_S))
+    if procesos > 1 and model.admite_procesos:
+        return transcribir_en_paralelo(model, audio, procesos, idioma, inicio_s)
+    return transcribir_ventanas(model, ventanas_de_audio([audio], inicio_s), idioma)
+
+
+# ===================== Tablas auxiliares (DB) =====================
+# Se crean al primer uso para no depender de una migración aparte.
+SQL_VIDEO_IDIOMAS = """
+    CREATE TABLE IF NOT EXISTS video_idiomas (
+        video_id text PRIMARY KEY REFERENCES uploads(id),
+        idioma text NOT NULL,
+        probabilidad real,
+        detectado_en timestamp without time zone DEFAULT now()
+    )
+"""
+
+SQL_SUBTITULOS_PROGRESO = """
+    CREATE TABLE IF NOT EXISTS subtitulos_progreso (
+        video_id text PRIMARY KEY REFERENCES uploads(id),
+        offset_s double precision NOT NULL DEFAULT 0,
+        completado boolean NOT NULL DEFAULT false,
+        actualizado_en timestamp without time zone DEFAULT now()
+    )
+"""
+
+
+SQL_UPLOADS_HASH = """
+    CREATE TABLE IF NOT EXISTS uploads_hash (
+        video_id text PRIMARY KEY REFERENCES uploads(id),
+        sha256 text NOT NULL,
+        bytes bigint,
+        calculado_en timestamp without time zone DEFAULT now()
+    )
+"""
+
+SQL_UPLOADS_HASH_IDX = "CREATE INDEX IF NOT EXISTS uploads_hash_sha256_idx ON uploads_hash (sha256)"
+
+# El reuso busca por huella (media_cache.huella): no hace falta el archivo
+# completo. sha256 queda para filas anteriores.
+SQL_UPLOADS_HASH_HUELLA = """
+    ALTER TABLE uploads_hash ADD COLUMN IF NOT EXISTS huella text;
+    ALTER TABLE uploads_hash ALTER COLUMN sha256 DROP NOT NULL;
+    CREATE INDEX IF NOT EXISTS uploads_hash_huella_idx ON uploads_hash (huella);
+"""
+
+
+def _asegurar_tablas(conn, cur):
+    cur.execute(SQL_VIDEO_IDIOMAS)
+    cur.execute(SQL_SUBTITULOS_PROGRESO)
+    cur.execute(SQL_UPLOADS_HASH)
+    conn.commit()
+    # índices y ALTER solo si faltan (se mira pg_indexes, como procesar_texto):
+    # ALTER TABLE toma ACCESS EXCLUSIVE y CREATE INDEX IF NOT EXISTS un SHARE
+    # sobre la tabla aunque ya exista, en cada trabajo
+    cur.execute("SELECT indexname FROM pg_indexes WHERE tablename = 'uploads_hash'")
+    indices = {r[0] for r in cur.fetchall()}
+    if "uploads_hash_sha256_idx" not in indices:
+        cur.execute(SQL_UPLOADS_HASH_IDX)
+    if "uploads_hash_huella_idx" not in indices:
+        # el índice se crea al final: si existe, las columnas ya están
+        cur.execute(SQL_UPLOADS_HASH_HUELLA)
+    conn.commit()
+
+
+def _idioma_guardado(cur, video_id: str) -> Optional[str]:
+    cur.execute("SELECT idioma FROM video_idiomas WHERE video_id = %s", (video_id,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def _guardar_idioma(cur, video_id: str, idioma: str, prob: float):
+    cur.execute(
+        """
+        INSERT INTO video_idiomas (video_id, idioma, probabilidad)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (video_id) DO UPDATE
+            SET idioma = EXCLUDED.idioma,
+                probabilidad = EXCLUDED.probabilidad,
+                detectado_en = now()
+        """,
+        (video_id, idioma, prob),
+    )
+
+
+def _leer_progreso(cur, video_id: str) -> Tuple[float, bool]:
+    cur.execute(
+        "SELECT offset_s, completado FROM subtitulos_progreso WHERE video_id = %s",
+        (video_id,),
+    )
+    row = cur.fetchone()
+    return (float(row[0]), bool(row[1])) if row else (0.0, False)
+
+
+def _guardar_progreso(cur, video_id: str, offset_s: float, completado: bool = False):
+    cur.execute(
+        """
+        INSERT INTO subtitulos_progreso (video_id, offset_s, completado)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (video_id) DO UPDATE
+            SET offset_s = EXCLUDED.offset_s,
+                completado = EXCLUDED.completado,
+                actualizado_en = now()
+        """,
+        (video_id, offset_s, completado),
+    )
+
+
+# ===================== Escritura de segmentos =====================
+SQL_INSERT_SUBTITULOS = """
+    INSERT INTO video_subtitulos (video_id, time_start, time_end, text)
+    VALUES %s
+"""
+
+
+def _insertar_lote(cur, filas: List[Tuple[str, float, float, str]]):
+    psycopg2.extras.execute_values(cur, SQL_INSERT_SUBTITULOS, filas, page_size=len(filas))
+
+
+Publicador = Callable[[dict], None]
+
+
+def _notificar(cur, video_id: str, offset_s: float, filas: int, completado: bool = False):
+    # pg_notify dentro de la transacción: se entrega recién con el commit
+    payload = {"video_id": video_id, "offset_s": offset_s, "filas": filas, "completado": completado}
+    cur.execute("SELECT pg_notify(%s, %s)", (NOTIFY_CANAL, json.dumps(payload)))
+
+
+def guardar_segmentos(
+    conn,
+    cur,
+    video_id: str,
+    resultados: Iterable[Resultado],
+    offset_s: float = 0.0,
+    publicar: Optional[Publicador] = None,
+) -> int:
+    # Inserta en bloques de INSERT_LOTE (o cada INSERT_INTERVALO_S). Cada
+    # bloque se confirma junto con el checkpoint en la misma transacción: las
+    # filas guardadas corresponden siempre exactamente hasta offset_s.
+    total = 0
+    filas: List[Tuple[str, float, float, str]] = []
+    ultimo_flush = time.monotonic()
+    for avance, segs in resultados:
+        filas.extend((video_id, ini, fin, text) for ini, fin, text in segs)
+        offset_s = max(offset_s, avance)
+        if publicar:
+            for ini, fin, text in segs:
+                publicar(
+                    {"tipo": "segmento", "video_id": video_id, "time_start": ini, "time_end": fin, "text": text}
+                )
+        if len(filas) >= INSERT_LOTE or time.monotonic() - ultimo_flush >= INSERT_INTERVALO_S:
+            if filas:
+                _insertar_lote(cur, filas)
+            _guardar_progreso(cur, video_id, offset_s)
+            _notificar(cur, video_id, offset_s, len(filas))
+            conn.commit()
+            total += len(filas)
+            filas = []
+            ultimo_flush = time.monotonic()
+    if filas:
+        _insertar_lote(cur, filas)
+        total += len(filas)
+    _guardar_progreso(cur, video_id, offset_s, completado=True)
+    _notificar(cur, video_id, offset_s, len(filas), completado=True)
+    conn.commit()
+    return total
+
+
+# ===================== Caché por contenido =====================
+def _guardar_hash(cur, video_id: str, huella: str, bytes_: int):
+    cur.execute(
+        """
+        INSERT INTO uploads_hash (video_id, huella, bytes)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (video_id) DO UPDATE
+            SET huella = EXCLUDED.huella,
+                sha256 = NULL,
+                bytes = EXCLUDED.bytes,
+                calculado_en = now()
+        """,
+        (video_id, huella, bytes_),
+    )
+
+
+def _fuente_por_hash(cur, video_id: str, huella: str, bytes_: int) -> Optional[Tuple[str, float]]:
+    # Otro upload con el mismo contenido y subtítulos completos
+    cur.execute(
+        """
+        SELECT h.video_id, p.offset_s
+          FROM uploads_hash h
+          JOIN subtitulos_progreso p ON p.video_id = h.video_id
+         WHERE h.huella = %s AND h.bytes = %s AND h.video_id <> %s AND p.completado
+         ORDER BY p.actualizado_en DESC
+         LIMIT 1
+        """,
+        (huella, bytes_, video_id),
+    )
+    row = cur.fetchone()
+    return (row[0], float(row[1])) if row else None
 
 
-def main(video_id: str):
+def _copiar_subtitulos(cur, video_id: str, fuente: str, offset_s: float) -> int:
+    # Un solo INSERT ... SELECT: sin descarga de audio ni ASR
+    cur.execute("DELETE FROM video_subtitulos WHERE video_id = %s", (video_id,))
+    cur.execute(
+        """
+        INSERT INTO video_subtitulos (video_id, time_start, time_end, text)
+        SELECT %s, time_start, time_end, text
+          FROM video_subtitulos
+         WHERE video_id = %s
+         ORDER BY time_start
+        """,
+        (video_id, fuente),
+    )
+    total = cur.rowcount
+    cur.execute(
+        """
+        INSERT INTO video_idiomas (video_id, idioma, probabilidad)
+        SELECT %s, idioma, probabilidad FROM video_idiomas WHERE video_id = %s
+        ON CONFLICT (video_id) DO NOTHING
+        """,
+        (video_id, fuente),
+    )
+    _guardar_progreso(cur, video_id, offset_s, completado=True)
+    _notificar(cur, video_id, offset_s, total, completado=True)
+    return total
+
+
+def procesar_video(
+    video_id: str,
+    model=None,
+    idioma: Optional[str] = None,
+    publicar: Optional[Publicador] = None,
+    propagar: bool = False,
+    url: Optional[str] = None,
+) -> int:
+    # propagar=True: los errores se relanzan (la cola de trabajos los reintenta)
+    # url: si quien llama ya la conoce (upload-minio, cola) no se consulta uploads
     print(f" Iniciando proceso de subtítulos para video_id={video_id}")
     conn = None
     cur = None
-    video_path = None
-    wav_path = None
-
-    # 🔹 Modelo "medium" para mejor precisión
-    model = whisper.load_model("medium")
+    medios = contextlib.ExitStack()  # archivos tomados de la caché de medios
+    total_inserted = 0
+    terminado = False
+    cache_path = _ruta_cache_pcm(video_id)
 
     try:
         print(" Conectando a la base de datos...")
@@ -76,110 +1073,113 @@ def main(video_id: str):
         conn = psycopg2.connect(**DB_CONFIG)
         cur = conn.cursor()
 
-        print(" Buscando el video en la tabla uploads...")
-        cur.execute("SELECT file_path FROM uploads WHERE id = %s", (video_id,))
-        row = cur.fetchone()
-        if not row:
-            print(f" ❌ No se encontró video con id {video_id} en uploads")
-            return
-
-        url = row[0]
         if not url:
-            print(" ❌ El campo file_path está vacío")
-            return
-
-        video_path = download_to_temp(url)
-        wav_path = convert_to_wav(video_path)
-
-        print(" Obteniendo duración del audio para dividir en fragmentos...")
-
-        def get_duration(file_path: str) -> float:
-            result = subprocess.run(
-                [
-                    "ffprobe",
-                    "-v",
-                    "error",
-                    "-show_entries",
-                    "format=duration",
-                    "-of",
-                    "default=noprint_wrappers=1:nokey=1",
-                    file_path,
-                ],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-            )
-            return float(result.stdout.strip() or 0)
+            print(" Buscando el video en la tabla uploads...")
+            cur.execute("SELECT file_path FROM uploads WHERE id = %s", (video_id,))
+            row = cur.fetchone()
+            if not row:
+                print(f" ❌ No se encontró video con id {video_id} en uploads")
+                return 0
 
-        duration_sec = get_duration(wav_path)
-        if duration_sec <= 0:
-            print(" ❌ Duración del audio inválida")
-            return
+            url = row[0]
+            if not url:
+                print(" ❌ El campo file_path está vacío")
+                return 0
 
-        total_chunks = math.ceil((duration_sec * 1000) / CHUNK_DURATION_MS)
-        print(f" Duración: {duration_sec:.2f} seg. Total fragmentos: {total_chunks}")
+        # el PCM de este video (y su parcial) quedan tomados mientras se usan
+        medios.enter_context(media_cache.usar(cache_path))
+        medios.enter_context(media_cache.usar(_ruta_parcial(cache_path)))
+        media_cache.evictar(
+            CACHE_MAX_BYTES, conservar=cache_path, directorio=CACHE_DIR, max_edad_s=CACHE_TTL_S
+        )
 
-        insert_sql = """
-            INSERT INTO video_subtitulos (video_id, time_start, time_end, text)
-            VALUES (%s, %s, %s, %s)
-        """
-        total_inserted = 0
+        _asegurar_tablas(conn, cur)
+        inicio_s, completado = _leer_progreso(cur, video_id)
+        if completado:
+            print(" ✅ Los subtítulos de este video ya estaban completos")
+            return 0
+        if inicio_s > 0:
+            print(f" Reanudando desde {inicio_s:.1f}s (checkpoint anterior)")
 
-        for i in range(total_chunks):
-            start_sec = (i * CHUNK_DURATION_MS) / 1000
-            duration = CHUNK_DURATION_MS / 1000
-            base, _ = os.path.splitext(wav_path)
-            chunk_path = f"{base}_chunk{i}.wav"
-
-            print(f" Fragmento {i+1}/{total_chunks} (inicio: {start_sec:.1f}s)")
-
-            subprocess.run(
-                [
-                    "ffmpeg",
-                    "-y",
-                    "-i",
-                    wav_path,
-                    "-ss",
-                    str(start_sec),
-                    "-t",
-                    str(duration),
-                    "-acodec",
-                    "copy",
-                    chunk_path,
-                ],
-                check=True,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-            )
+        clave = None
+        if DEDUP_ACTIVO and inicio_s <= 0:
+            # huella (tamaño + primer/último MiB): dos rangos HTTP, sin bajar
+            # el archivo; el audio sigue yendo por streaming
+            t0 = time.perf_counter()
+            try:
+                clave = media_cache.huella(url)
+            except Exception as e:
+                print(f" Aviso: no se pudo calcular la huella del contenido ({e})")
+            if clave is None:
+                print(" Sin huella del contenido: no se buscan subtítulos reutilizables")
+            else:
+                print(f"  -> huella {clave[0][:16]}… ({clave[1] / 1e6:.1f} MB, {time.perf_counter() - t0:.2f}s)")
+        if clave:
+            _guardar_hash(cur, video_id, clave[0], clave[1])
+            fuente = _fuente_por_hash(cur, video_id, clave[0], clave[1])
+            if fuente:
+                print(f" ♻️ Mismo contenido que el video {fuente[0]}: se copian sus subtítulos")
+                total_inserted = _copiar_subtitulos(cur, video_id, fuente[0], fuente[1])
+                conn.commit()
+                terminado = True
+                print(f" ✅ Proceso completado. Total subtítulos copiados: {total_inserted}")
+                return total_inserted
+            conn.commit()
 
-            print("  Transcribiendo fragmento...")
-            result = model.transcribe(
-                chunk_path,
-                fp16=False,
-                task="transcribe",  # 🔹 Solo transcribir, sin traducir
-                language=None,      # 🔹 Auto-detectar idioma
-            )
+        idioma = idioma or IDIOMA_FORZADO or _idioma_guardado(cur, video_id)
+        if idioma:
+            print(f" Idioma: {idioma}" + (" (por ventana)" if idioma == IDIOMA_MULTI else ""))
 
-            print("  Guardando resultados en la base de datos...")
-            for seg in result.get("segments", []):
-                abs_start = seg["start"] + start_sec
-                abs_end = seg["end"] + start_sec
-                text = (seg.get("text") or "").strip()
-                if text:
-                    cur.execute(insert_sql, (video_id, abs_start, abs_end, text))
-                    total_inserted += 1
+        # El modelo se pide recién aquí: si el upload no existe no se paga la carga
+        if model is None:
+            model = get_model()
 
-            # borrar chunk
-            try:
-                os.remove(chunk_path)
-            except OSError:
-                pass
+        desde = int(inicio_s * SAMPLE_RATE)
+        ventanas = None
+        # audio: PCM de una corrida anterior > streaming desde la URL >
+        # archivo (caché de medios si ya está ahí, o descarga)
+        audio = cargar_pcm_cache(cache_path)
+        if audio is not None:
+            audio = audio[desde:]
+        elif STREAMING and url.startswith(("http://", "https://")) and not media_cache.existe(url):
+            if NUM_PROCESOS > 1:
+                # los rangos necesitan el audio completo; la descarga igual
+                # se solapa con la decodificación
+                bloques = list(stream_audio(url, inicio_s, cache_path))
+                audio = np.concatenate(bloques) if bloques else np.zeros(0, np.float32)
+            else:
+                ventanas = ventanas_de_audio(stream_audio(url, inicio_s, cache_path), inicio_s)
+        else:
+            video_path = medios.enter_context(media_cache.abrir(url))
+            audio = decode_audio(video_path, cache_path)[desde:]
+
+        if not idioma:
+            # una sola detección por video, antes de transcribir
+            idioma, prob, resto = detectar_idioma(
+                model, ventanas if ventanas is not None else ventanas_de_audio([audio], inicio_s)
+            )
+            if ventanas is not None:
+                ventanas = resto
+            if idioma:
+                _guardar_idioma(cur, video_id, idioma, prob)
+                conn.commit()
 
-        conn.commit()
+        idioma_ventana = None if idioma == IDIOMA_MULTI else idioma
+        if ventanas is not None:
+            resultados = transcribir_ventanas(model, ventanas, idioma_ventana)
+        else:
+            resultados = transcribir_audio(model, audio, idioma_ventana, inicio_s)
+
+        print(" Transcribiendo y guardando resultados en la base de datos...")
+        total_inserted = guardar_segmentos(conn, cur, video_id, resultados, inicio_s, publicar)
+        terminado = True
         print(f" ✅ Proceso completado. Total subtítulos guardados: {total_inserted}")
 
     except Exception as e:
         print("❌ ERROR GENERAL:", e)
+        total_inserted = 0
+        if propagar:
+            raise
 
     finally:
         print(" Limpiando archivos temporales y cerrando conexiones...")
@@ -193,19 +1193,214 @@ def main(video_id: str):
                 conn.close()
             except Exception:
                 pass
-        for p in (video_path, wav_path):
-            if p and os.path.exists(p):
+        # el archivo original queda en la caché de medios (lo evicta media_cache);
+        # el audio decodificado solo se conserva si hay que reanudar
+        medios.close()
+        if terminado:
+            parcial = _ruta_parcial(cache_path)
+            for path in (cache_path, cache_path + ".lock", parcial, parcial + ".lock"):
+                if os.path.exists(path):
+                    try:
+                        os.remove(path)
+                    except Exception:
+                        pass
+
+    return total_inserted
+
+
+# ===================== Worker (modelo residente) =====================
+def _enviar_linea(conn: socket.socket, obj: dict):
+    conn.sendall((json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8"))
+
+
+def run_worker(socket_path: str = SOCKET_PATH):
+    if not hasattr(socket, "AF_UNIX"):
+        print(" ❌ El modo worker necesita sockets UNIX (no disponible en esta plataforma)")
+        sys.exit(1)
+
+    # Socket huérfano de un worker anterior: si nadie responde, se elimina
+    if os.path.exists(socket_path):
+        if _worker_vivo(socket_path):
+            print(f" ❌ Ya hay un worker escuchando en {socket_path}")
+            sys.exit(1)
+        os.remove(socket_path)
+
+    model = get_model()
+
+    srv = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    srv.bind(socket_path)
+    srv.listen(128)  # la cola de conexiones pendientes hace de cola de trabajos
+    print(f" Worker de subtítulos escuchando en {socket_path}")
+
+    try:
+        while True:
+            conn, _ = srv.accept()
+            with conn:
                 try:
-                    os.remove(p)
-                except Exception:
+                    job = json.loads(conn.makefile("rb").readline() or b"{}")
+                except ValueError:
+                    job = {}
+                video_id = str(job.get("video_id") or "")
+
+                cliente_vivo = [True]
+
+                def publicar(evento: dict):
+                    # eventos parciales hacia el cliente (si pidió --jsonl)
+                    if cliente_vivo[0]:
+                        try:
+                            _enviar_linea(conn, evento)
+                        except OSError:
+                            cliente_vivo[0] = False
+
+                if not video_id:
+                    reply = {"ok": False, "error": "video_id requerido"}
+                else:
+                    t0 = time.perf_counter()
+                    try:
+                        total = procesar_video(
+                            video_id,
+                            model,
+                            job.get("idioma"),
+                            publicar if job.get("eventos") else None,
+                            propagar=True,
+                            url=job.get("url"),
+                        )
+                        reply = {
+                            "ok": True,
+                            "video_id": video_id,
+                            "total": total,
+                            "segundos": round(time.perf_counter() - t0, 3),
+                        }
+                    except Exception as e:
+                        # el worker sigue atendiendo; el cliente reporta el error
+                        reply = {
+                            "ok": False,
+                            "video_id": video_id,
+                            "error": str(e) or type(e).__name__,
+                            "segundos": round(time.perf_counter() - t0, 3),
+                        }
+                try:
+                    _enviar_linea(conn, reply)
+                except OSError:
+                    # el cliente se fue; el trabajo ya quedó en la DB
                     pass
+    except KeyboardInterrupt:
+        print(" Worker detenido")
+    finally:
+        srv.close()
+        try:
+            os.remove(socket_path)
+        except OSError:
+            pass
+
+
+def _worker_vivo(socket_path: str = SOCKET_PATH) -> bool:
+    # Basta con que acepte la conexión: un worker ocupado igual está vivo
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.settimeout(2)
+            s.connect(socket_path)
+        return True
+    except OSError:
+        return False
+
+
+def _enviar_al_worker(
+    job: dict, socket_path: str = SOCKET_PATH, publicar: Optional[Publicador] = None
+) -> Optional[dict]:
+    # None = no hay worker; la CLI entonces procesa en el mismo proceso.
+    # Sin timeout: si el worker está ocupado, el trabajo espera su turno.
+    # Las líneas con "tipo" son eventos parciales; la última es la respuesta.
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(socket_path):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.connect(socket_path)
+            _enviar_linea(s, {**job, "eventos": publicar is not None})
+            for raw in s.makefile("rb"):
+                try:
+                    msg = json.loads(raw)
+                except ValueError:
+                    continue
+                if "tipo" in msg:
+                    if publicar:
+                        publicar(msg)
+                    continue
+                return msg
+    except OSError:
+        return None
+    return None
+
+
+def _publicar_stdout(evento: dict):
+    print(json.dumps(evento, ensure_ascii=False), flush=True)
+
+
+def main(
+    video_id: str,
+    idioma: Optional[str] = None,
+    jsonl: bool = False,
+    url: Optional[str] = None,
+):
+    publicar = _publicar_stdout if jsonl else None
+    error = None
+    reply = _enviar_al_worker({"video_id": video_id, "idioma": idioma, "url": url}, publicar=publicar)
+    if reply is not None:
+        if reply.get("ok"):
+            print(
+                f" ✅ Procesado por el worker en {reply.get('segundos')}s. "
+                f"Total subtítulos guardados: {reply.get('total')}"
+            )
+        else:
+            error = reply.get("error") or "error desconocido"
+            print(f" ❌ El worker no pudo procesar el video: {error}")
+        total = reply.get("total") or 0
+    else:
+        try:
+            total = procesar_video(video_id, idioma=idioma, publicar=publicar, propagar=True, url=url)
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            total = 0
+
+    if publicar:
+        fin = {"tipo": "fin", "video_id": video_id, "total": total}
+        if error:
+            fin["error"] = error
+        publicar(fin)
+    if error:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print(" Uso: python procesar_subtitulos.py <video_id>")
+    if len(sys.argv) >= 2 and sys.argv[1] == "--worker":
+        run_worker()
+        sys.exit(0)
+    args = sys.argv[1:]
+    jsonl_cli = "--jsonl" in args
+    if jsonl_cli:
+        args.remove("--jsonl")
+    idioma_cli = None
+    if "--idioma" in args:
+        i = args.index("--idioma")
+        idioma_cli = args[i + 1] if i + 1 < len(args) else None
+        del args[i : i + 2]
+    # --json '{"upload_id": ..., "url": ..., "idioma": ...}': el trabajo completo
+    job_cli: dict = {}
+    if "--json" in args:
+        i = args.index("--json")
+        try:
+            job_cli = json.loads(args[i + 1]) if i + 1 < len(args) else {}
+        except ValueError:
+            job_cli = {}
+        del args[i : i + 2]
+    video_id_cli = args[0] if args else job_cli.get("upload_id") or job_cli.get("video_id")
+    if not video_id_cli or ("--idioma" in sys.argv and not idioma_cli):
+        print(" Uso: python procesar_subtitulos.py <video_id> [url] [--idioma es|multi] [--jsonl]")
+        print("      python procesar_subtitulos.py --json '{\"upload_id\": ..., \"url\": ...}' [--jsonl]")
+        print("      python procesar_subtitulos.py --worker")
         sys.exit(1)
-    main(sys.argv[1])
+    url_cli = args[1] if len(args) >= 2 else job_cli.get("url")
+    main(str(video_id_cli), idioma_cli or job_cli.get("idioma"), jsonl_cli, url_cli)
 
 
 
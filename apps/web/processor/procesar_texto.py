@@ -1,12 +1,19 @@
 import os
 import sys
-import requests
+import json
+import time
+import uuid
+import codecs
 import tempfile
+import multiprocessing
 import psycopg2
-import docx  # python-docx
 from datetime import datetime
 from pathlib import Path
-from typing import Optional, List
+from typing import Iterable, Iterator, Optional, List, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import unquote
+
+import media_cache
 
 # ----------------- Consola UTF-8 (arregla 'charmap' en Windows) -----------------
 try:
@@ -25,6 +32,33 @@ DB_CONFIG = {
     "port": os.getenv("PGPORT", "5432"),
 }
 
+# ----------------- Config PDF -----------------
+# Las páginas se reparten en rangos entre procesos; cada página que pdfplumber
+# no puede leer se extrae con pypdf sin rehacer el documento entero.
+PDF_PROCESOS = max(1, int(os.getenv("TEXTO_PDF_PROCESOS", str(min(4, os.cpu_count() or 1)))))
+PDF_PAGINAS_MIN_RANGO = 8  # con menos páginas por proceso no compensa el pool
+
+# Motor: "auto" sondea el PDF y usa pypdf (texto plano, rápido) salvo que el
+# texto salga roto; ahí usa pdfplumber (análisis de layout, mucho más lento).
+PDF_MOTORES = ("pypdf", "pdfplumber")
+PDF_MOTOR = os.getenv("TEXTO_PDF_MOTOR", "auto").lower()
+PDF_SONDEO_PAGINAS = 5
+PDF_MIN_CHARS_PAGINA = 20
+
+# ----------------- Config texto -----------------
+# La extracción se recorre bloque a bloque (páginas / párrafos) y el texto va a
+# un archivo temporal que se manda a Postgres con COPY: la memoria no crece con
+# el tamaño del archivo (logs / CSV de cientos de MB).
+TEXTO_BLOQUE_MAX_CHARS = int(os.getenv("TEXTO_BLOQUE_MAX_KB", "64")) * 1024
+TEXTO_SPOOL_BYTES = int(os.getenv("TEXTO_SPOOL_MB", "8")) * 1024 * 1024
+TEXTO_LECTURA_BYTES = 1024 * 1024
+
+# Encoding: se miran muestras acotadas (inicio, medio y final). BOM o UTF-8
+# válido resuelven sin chardet; si no, chardet incremental hasta un tope.
+TEXTO_MUESTRA_BYTES = int(os.getenv("TEXTO_MUESTRA_KB", "64")) * 1024
+TEXTO_DETECCION_MAX_BYTES = int(os.getenv("TEXTO_DETECCION_MAX_KB", "1024")) * 1024
+TEXTO_ENCODING_DEFECTO = "cp1252"  # no es UTF-8 y chardet no decide
+
 # ----------------- Utilidades tipo / paths -----------------
 def _ext_from(name_or_url: str) -> str:
     base = name_or_url.split("?")[0].split("#")[0]
@@ -42,114 +76,320 @@ def _guess_kind(file_name: str, content_type: Optional[str] = None) -> str:
         return "txt"
     return "desconocido"
 
-def _download_to_temp(url: str, suffix: str) -> str:
-    with requests.get(url, stream=True, timeout=60) as r:
-        r.raise_for_status()
-        fd, tmp_path = tempfile.mkstemp(suffix=suffix)
-        with os.fdopen(fd, "wb") as f:
-            for chunk in r.iter_content(chunk_size=1024 * 64):
-                if chunk:
-                    f.write(chunk)
-    return tmp_path
+# extensión del archivo en la caché de medios según el tipo
+_SUFIJOS = {
+    "docx": ".docx",
+    "pdf": ".pdf",
+    "txt": ".txt",
+    "desconocido": ".bin",
+}
 
 # ----------------- Extractores -----------------
-def _extract_docx(path_docx: str) -> List[str]:
+def _extract_docx(path_docx: str) -> Iterator[str]:
+    import docx  # type: ignore  # python-docx (solo si hay un .docx)
+
     d = docx.Document(path_docx)
-    return [p.text.strip() for p in d.paragraphs if p.text and p.text.strip()]
+    for p in d.paragraphs:
+        if p.text and p.text.strip():
+            yield p.text.strip()
+
+def sondear_pdf(path_pdf: str) -> dict:
+    # Mirada rápida con pypdf a unas pocas páginas: cantidad de páginas, si hay
+    # capa de texto y si el texto plano sale "roto" (palabras pegadas o una
+    # letra por línea: columnas, tablas, texto rotado), que es cuando vale la
+    # pena el análisis de layout de pdfplumber.
+    from pypdf import PdfReader  # type: ignore
+
+    lector = PdfReader(path_pdf)
+    n = len(lector.pages)
+    muestra = sorted({*range(min(n, 3)), n // 2, n - 1} - {-1})[:PDF_SONDEO_PAGINAS]
+    chars = 0
+    palabras = 0
+    largas = 0
+    lineas = 0
+    lineas_cortas = 0
+    for i in muestra:
+        try:
+            t = lector.pages[i].extract_text() or ""
+        except Exception:
+            # pypdf no puede con esta página: señal para usar pdfplumber
+            return {"num_paginas": n, "con_texto": True, "complejo": True}
+        chars += len(t.strip())
+        for tok in t.split():
+            palabras += 1
+            largas += len(tok) > 25
+        for linea in t.splitlines():
+            if linea.strip():
+                lineas += 1
+                lineas_cortas += len(linea.strip()) <= 2
+    complejo = bool(
+        (palabras and largas / palabras > 0.05) or (lineas and lineas_cortas / lineas > 0.3)
+    )
+    return {
+        "num_paginas": n,
+        "con_texto": chars >= PDF_MIN_CHARS_PAGINA * max(1, len(muestra)),
+        "complejo": complejo,
+    }
+
+def elegir_motor_pdf(sondeo: dict) -> str:
+    if PDF_MOTOR in PDF_MOTORES:
+        return PDF_MOTOR
+    if not sondeo["con_texto"]:
+        # escaneado: ningún motor saca texto sin OCR, se usa el barato
+        print(" Aviso PDF: sin capa de texto (¿escaneado?)")
+        return "pypdf"
+    return "pdfplumber" if sondeo["complejo"] else "pypdf"
 
-def _extract_pdf(path_pdf: str) -> List[str]:
-    text = []
+def _iterar_rango_pdf(path_pdf: str, ini: int, fin: int, motor: str = "pdfplumber") -> Iterator[str]:
+    # Texto de las páginas [ini, fin), una entrada por página (vacía si no hay).
+    # Si el motor elegido falla en una página, esa página usa el otro.
+    abiertos: dict = {}
+
+    def _abrir(nombre: str):
+        if nombre not in abiertos:
+            try:
+                if nombre == "pdfplumber":
+                    import pdfplumber  # type: ignore
+                    abiertos[nombre] = pdfplumber.open(path_pdf)
+                else:
+                    from pypdf import PdfReader  # type: ignore
+                    abiertos[nombre] = PdfReader(path_pdf)
+            except Exception as e:
+                print(f" Aviso PDF: no se pudo abrir con {nombre} ->", e)
+                abiertos[nombre] = None
+        return abiertos[nombre]
+
+    def _pagina(nombre: str, i: int) -> str:
+        doc = _abrir(nombre)
+        if doc is None:
+            raise RuntimeError(f"{nombre} no disponible")
+        page = doc.pages[i]
+        t = page.extract_text() or ""
+        if hasattr(page, "close"):
+            page.close()  # pdfplumber: libera la caché de objetos de la página
+        return t
+
+    otro = "pypdf" if motor == "pdfplumber" else "pdfplumber"
     try:
-        import pdfplumber  # type: ignore
-        with pdfplumber.open(path_pdf) as pdf:
-            for page in pdf.pages:
-                t = page.extract_text() or ""
-                t = t.strip()
-                if t:
-                    text.append(t)
-        return text
+        for i in range(ini, fin):
+            try:
+                t = _pagina(motor, i)
+            except Exception as e:
+                print(f" Aviso PDF: página {i + 1} con fallback {otro} ->", e)
+                try:
+                    t = _pagina(otro, i)
+                except Exception as e2:
+                    print(f" Error PDF ({otro}) en página {i + 1}:", e2)
+                    t = ""
+            yield t.strip()
+    finally:
+        pdf = abiertos.get("pdfplumber")
+        if pdf is not None:
+            pdf.close()
+
+def _extraer_rango_pdf(path_pdf: str, ini: int, fin: int, motor: str = "pdfplumber") -> List[str]:
+    # versión en lista para los procesos del pool (el resultado se serializa)
+    return list(_iterar_rango_pdf(path_pdf, ini, fin, motor))
+
+def _rangos_pdf(num_paginas: int, procesos: int) -> List[Tuple[int, int]]:
+    if num_paginas <= 0:
+        return []
+    procesos = max(1, min(procesos, num_paginas // PDF_PAGINAS_MIN_RANGO))
+    paso = -(-num_paginas // procesos)
+    return [(i, min(i + paso, num_paginas)) for i in range(0, num_paginas, paso)]
+
+def _extract_pdf(path_pdf: str, meta: Optional[dict] = None) -> Iterator[Tuple[int, str]]:
+    # (número de página desde 1, texto) de las páginas con texto
+    try:
+        sondeo = sondear_pdf(path_pdf)
     except Exception as e:
-        print(" Aviso PDF: usando fallback pypdf ->", e)
+        # pypdf no lo abre: se intenta igual con pdfplumber
+        print(" Aviso PDF: sondeo con pypdf falló ->", e)
         try:
-            from pypdf import PdfReader  # type: ignore
-            reader = PdfReader(path_pdf)
-            for p in reader.pages:
-                t = p.extract_text() or ""
-                t = t.strip()
-                if t:
-                    text.append(t)
-            return text
+            import pdfplumber  # type: ignore
+            with pdfplumber.open(path_pdf) as pdf:
+                sondeo = {"num_paginas": len(pdf.pages), "con_texto": True, "complejo": True}
         except Exception as e2:
-            print(" Error PDF (pypdf):", e2)
-            return []
+            print(" Error PDF:", e2)
+            return
+    num_paginas = sondeo["num_paginas"]
+    motor = elegir_motor_pdf(sondeo)
+    if meta is not None:
+        meta["num_paginas"] = num_paginas
+        meta["motor"] = motor
+    print(f" PDF de {num_paginas} páginas -> motor {motor}")
+
+    rangos = _rangos_pdf(num_paginas, PDF_PROCESOS)
+    if not rangos:
+        return
+    if len(rangos) <= 1:
+        paginas: Iterable[str] = _iterar_rango_pdf(path_pdf, 0, num_paginas, motor)
+        yield from ((i, t) for i, t in enumerate(paginas, start=1) if t)
+        return
+    print(f" Extrayendo {num_paginas} páginas en {len(rangos)} procesos")
+    # forkserver (spawn si no hay), no fork: dentro del daemon de la cola hay
+    # hilos (LISTEN, latidos, carriles) y torch cargado; un hijo forkeado puede
+    # heredar un lock tomado (stdout, libgomp) y colgarse
+    metodo = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    with ProcessPoolExecutor(max_workers=len(rangos), mp_context=multiprocessing.get_context(metodo)) as pool:
+        # map devuelve los rangos en orden: las páginas quedan en orden y cada
+        # rango se entrega apenas está listo
+        partes = pool.map(
+            _extraer_rango_pdf,
+            [path_pdf] * len(rangos),
+            [a for a, _ in rangos],
+            [b for _, b in rangos],
+            [motor] * len(rangos),
+        )
+        for (ini, _), parte in zip(rangos, partes):
+            yield from ((ini + i, t) for i, t in enumerate(parte, start=1) if t)
 
-def _read_text_with_fallback(path_txt: str) -> str:
+_BOMS = (
+    (codecs.BOM_UTF32_LE, "utf-32"),  # antes que UTF-16 LE: comparten prefijo
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+def _muestras_texto(path_txt: str) -> List[Tuple[int, bytes]]:
+    # [(posición, bytes)]: el archivo entero si es chico, si no inicio/medio/final
+    tam = os.path.getsize(path_txt)
+    with open(path_txt, "rb") as fb:
+        if tam <= 3 * TEXTO_MUESTRA_BYTES:
+            return [(0, fb.read())]
+        muestras = []
+        for pos in (0, tam // 2, tam - TEXTO_MUESTRA_BYTES):
+            fb.seek(pos)
+            muestras.append((pos, fb.read(TEXTO_MUESTRA_BYTES)))
+        return muestras
+
+def _es_utf8(muestra: bytes, inicio: bool, final: bool) -> bool:
+    if b"\x00" in muestra:
+        return False  # NUL: más probable UTF-16/32 sin BOM
+    if not inicio:
+        # la muestra puede empezar a mitad de un carácter
+        i = 0
+        while i < 3 and i < len(muestra) and 0x80 <= muestra[i] < 0xC0:
+            i += 1
+        muestra = muestra[i:]
     try:
-        import chardet  # type: ignore
-        with open(path_txt, "rb") as fb:
-            raw = fb.read()
-        enc = chardet.detect(raw).get("encoding") or "utf-8"
-        return raw.decode(enc, errors="replace")
-    except Exception:
-        for enc in ("utf-8", "latin-1", "cp1252"):
-            try:
-                with open(path_txt, "r", encoding=enc, errors="replace") as f:
-                    return f.read()
-            except Exception:
-                continue
-    return ""
+        # final=False tolera un carácter cortado al final de la muestra
+        codecs.getincrementaldecoder("utf-8")().decode(muestra, final=final)
+        return True
+    except UnicodeDecodeError:
+        return False
+
+def _detectar_encoding(path_txt: str) -> str:
+    tam = os.path.getsize(path_txt)
+    muestras = _muestras_texto(path_txt)
+    cabeza = muestras[0][1]
+    for bom, enc in _BOMS:
+        if cabeza.startswith(bom):
+            return enc
+    if all(_es_utf8(m, pos == 0, pos + len(m) >= tam) for pos, m in muestras):
+        return "utf-8"
+
+    # chardet incremental, acotado a TEXTO_DETECCION_MAX_BYTES
+    try:
+        from chardet.universaldetector import UniversalDetector  # type: ignore
+    except ImportError:
+        return TEXTO_ENCODING_DEFECTO
+    detector = UniversalDetector()
+    leido = 0
+    with open(path_txt, "rb") as fb:
+        for bloque in iter(lambda: fb.read(TEXTO_MUESTRA_BYTES), b""):
+            detector.feed(bloque)
+            leido += len(bloque)
+            if detector.done or leido >= TEXTO_DETECCION_MAX_BYTES:
+                break
+    detector.close()
+    enc = (detector.result or {}).get("encoding")
+    if not enc or enc.lower() == "ascii":
+        # ascii en el prefijo pero hay bytes no UTF-8 más adelante
+        return TEXTO_ENCODING_DEFECTO
+    return enc
 
-def _extract_txt_like(path_txt: str) -> List[str]:
-    content = _read_text_with_fallback(path_txt)
-    content = content.replace("\r\n", "\n")
-    blocks = [b.strip() for b in content.split("\n\n") if b.strip()]
-    return blocks if blocks else ([content.strip()] if content.strip() else [])
+def _extract_txt_like(path_txt: str) -> Iterator[str]:
+    # Bloques separados por líneas en blanco; un bloque sin líneas en blanco
+    # (CSV, logs) se corta en fronteras de línea cada TEXTO_BLOQUE_MAX_CHARS
+    enc = _detectar_encoding(path_txt)
+    try:
+        f = open(path_txt, "r", encoding=enc, errors="replace")
+    except LookupError:
+        f = open(path_txt, "r", encoding="utf-8", errors="replace")
+    with f:
+        lineas: List[str] = []
+        largo = 0
+        for linea in f:  # newline universal: \r\n y \r llegan como \n
+            if not linea.strip():
+                if lineas:
+                    yield "".join(lineas).strip()
+                    lineas, largo = [], 0
+                continue
+            lineas.append(linea)
+            largo += len(linea)
+            if largo >= TEXTO_BLOQUE_MAX_CHARS:
+                yield "".join(lineas).strip()
+                lineas, largo = [], 0
+        if lineas:
+            yield "".join(lineas).strip()
 
 # ----------------- Cargar texto multi-formato -----------------
-def cargar_texto(
+def iterar_bloques(
     file_path_or_url: str,
     file_name_hint: Optional[str] = None,
     content_type_hint: Optional[str] = None,
-) -> List[str]:
+    meta: Optional[dict] = None,
+) -> Iterator[Tuple[Optional[int], str]]:
+    # (página, texto) de a un párrafo / página, sin armar el documento en
+    # memoria; la página es None en formatos sin páginas (docx, texto).
+    # meta (opcional) recibe datos del documento: num_paginas, motor, segundos
+    # (completos recién cuando se termina de recorrer)
     name_for_type = file_name_hint or file_path_or_url
     kind = _guess_kind(name_for_type, content_type_hint)
 
-    suffix = {
-        "docx": ".docx",
-        "pdf": ".pdf",
-        "txt": ".txt",
-        "desconocido": ".bin",
-    }.get(kind, ".bin")
+    suffix = _SUFIJOS.get(kind, ".bin")
 
     is_url = file_path_or_url.startswith(("http://", "https://"))
-    tmp_path = None
-    local_path = None
+    if not is_url and not os.path.exists(file_path_or_url):
+        raise FileNotFoundError(f"Archivo no encontrado: {file_path_or_url}")
 
-    try:
-        if is_url:
-            print(f" Descargando archivo desde: {file_path_or_url}")
-            tmp_path = _download_to_temp(file_path_or_url, suffix=suffix)
-            local_path = tmp_path
-        else:
-            if not os.path.exists(file_path_or_url):
-                raise FileNotFoundError(f"Archivo no encontrado: {file_path_or_url}")
-            local_path = file_path_or_url
-
-        if kind == "docx":
-            return _extract_docx(local_path)
-        elif kind == "pdf":
-            return _extract_pdf(local_path)
-        elif kind == "txt":
-            return _extract_txt_like(local_path)
-        else:
-            print(" Aviso: tipo no soportado para extracción de texto.")
-            return []
-    finally:
-        if is_url and tmp_path and os.path.exists(tmp_path):
-            try:
-                os.remove(tmp_path)
-            except Exception:
-                pass
+    # URLs: se toman de la caché de medios compartida (no se borran al terminar)
+    with media_cache.abrir(file_path_or_url, suffix=suffix) as local_path:
+        if meta is None:
+            meta = {}
+        t0 = time.perf_counter()
+        try:
+            if kind == "docx":
+                meta["motor"] = "python-docx"
+                yield from ((None, t) for t in _extract_docx(local_path))
+            elif kind == "pdf":
+                yield from _extract_pdf(local_path, meta)
+            elif kind == "txt":
+                meta["motor"] = "texto"
+                yield from ((None, t) for t in _extract_txt_like(local_path))
+            else:
+                print(" Aviso: tipo no soportado para extracción de texto.")
+        finally:
+            meta["segundos"] = round(time.perf_counter() - t0, 3)
+
+def iterar_texto(
+    file_path_or_url: str,
+    file_name_hint: Optional[str] = None,
+    content_type_hint: Optional[str] = None,
+    meta: Optional[dict] = None,
+) -> Iterator[str]:
+    for _, texto in iterar_bloques(file_path_or_url, file_name_hint, content_type_hint, meta):
+        yield texto
+
+def cargar_texto(
+    file_path_or_url: str,
+    file_name_hint: Optional[str] = None,
+    content_type_hint: Optional[str] = None,
+    meta: Optional[dict] = None,
+) -> List[str]:
+    return list(iterar_texto(file_path_or_url, file_name_hint, content_type_hint, meta))
 
 # ----------------- Métricas -----------------
 def contar_palabras(texto: str):
@@ -162,76 +402,399 @@ def contar_palabras(texto: str):
         "num_frases": num_frases,
     }
 
+def estadisticas_vacias() -> dict:
+    return {"num_lineas": 0, "num_palabras": 0, "num_frases": 0}
+
+def sumar_estadisticas(stats: dict, parrafo: str) -> dict:
+    # Equivale a contar_palabras("\n".join(parrafos)) sumando de a un párrafo
+    stats["num_lineas"] += parrafo.count("\n") + 1
+    stats["num_palabras"] += len(parrafo.split())
+    stats["num_frases"] += sum(parrafo.count(x) for x in (".", "!", "?"))
+    return stats
+
+# ----------------- Escritura con COPY -----------------
+_COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\n": "\\n", "\r": "\\r", "\t": "\\t", "\x00": None})
+
+def _copy_valor(v) -> str:
+    # formato text de COPY (NUL no es válido en columnas text de Postgres)
+    if v is None:
+        return "\\N"
+    if isinstance(v, datetime):
+        v = v.isoformat()
+    return str(v).translate(_COPY_ESCAPES)
+
+class _LectorCopy:
+    # file-like para copy_expert: concatena trozos en memoria y archivos
+    # abiertos sin leerlos enteros
+    def __init__(self, partes: list):
+        self.partes = partes
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = TEXTO_LECTURA_BYTES
+        while self.partes:
+            parte = self.partes[0]
+            if isinstance(parte, bytes):
+                self.partes.pop(0)
+                if len(parte) > size:
+                    self.partes.insert(0, parte[size:])
+                    parte = parte[:size]
+                if parte:
+                    return parte
+                continue
+            datos = parte.read(size)
+            if datos:
+                return datos
+            self.partes.pop(0)
+        return b""
+
 # ----------------- Main -----------------
-def main(upload_id: str):
+def _nombre_desde_url(url: str) -> str:
+    # las claves de MinIO son "<uuid>_<nombre original>"
+    nombre = unquote(os.path.basename(url.split("?")[0].split("#")[0]))
+    if len(nombre) > 37 and nombre[36] == "_":
+        nombre = nombre[37:]
+    return nombre
+
+# Columnas agregadas por este script (sin migración aparte): se consultan en
+# information_schema para no tomar el lock de ALTER TABLE en cada corrida
+COLUMNAS_EXTRA = {
+    "motor_extraccion": "text",
+    "segundos_extraccion": "real",
+    "sha256": "text",  # del archivo original: si no cambió no se reextrae
+}
+
+# Bloques del documento (un párrafo o una página por fila) para búsqueda por
+# página y lectura paginada sin traer documentos_texto.texto entero.
+# offset_chars: posición (desde 0) del bloque dentro de documentos_texto.texto,
+# donde los bloques van unidos por "\n".
+SQL_DOCUMENTOS_BLOQUES = """
+    CREATE TABLE IF NOT EXISTS documentos_texto_bloques (
+        documento_id uuid NOT NULL REFERENCES documentos_texto(id) ON DELETE CASCADE,
+        parrafo integer NOT NULL,
+        pagina integer,
+        offset_chars bigint NOT NULL,
+        texto text NOT NULL,
+        PRIMARY KEY (documento_id, parrafo)
+    )
+"""
+
+SQL_DOCUMENTOS_BLOQUES_IDX = (
+    "CREATE INDEX IF NOT EXISTS documentos_texto_bloques_pagina_idx "
+    "ON documentos_texto_bloques (documento_id, pagina)"
+)
+
+# Una fila por upload. Las filas duplicadas de corridas anteriores se
+# borran (queda la más nueva) una sola vez, antes de crear el índice.
+SQL_DOCUMENTOS_UNICO = (
+    "CREATE UNIQUE INDEX IF NOT EXISTS documentos_texto_upload_id_key ON documentos_texto (upload_id)"
+)
+
+SQL_BORRAR_DUPLICADOS = """
+    DELETE FROM documentos_texto
+     WHERE id IN (
+        SELECT id FROM (
+            SELECT id, row_number() OVER (
+                       PARTITION BY upload_id ORDER BY creado_en DESC NULLS LAST, id
+                   ) AS n
+              FROM documentos_texto
+        ) t
+         WHERE n > 1
+     )
+"""
+
+def _asegurar_unico(conn, cur):
+    cur.execute(
+        "SELECT 1 FROM pg_indexes WHERE tablename = 'documentos_texto' AND indexname = 'documentos_texto_upload_id_key'"
+    )
+    if cur.fetchone():
+        return
+    # sin inserts concurrentes entre el borrado y el índice
+    cur.execute("LOCK TABLE documentos_texto IN SHARE ROW EXCLUSIVE MODE")
+    cur.execute(SQL_BORRAR_DUPLICADOS)
+    if cur.rowcount:
+        print(f" documentos_texto: {cur.rowcount} filas duplicadas borradas")
+    cur.execute(SQL_DOCUMENTOS_UNICO)
+    conn.commit()
+
+def _asegurar_tablas(conn, cur):
+    cur.execute(SQL_DOCUMENTOS_BLOQUES)
+    # CREATE INDEX IF NOT EXISTS toma un SHARE sobre la tabla aunque el índice
+    # exista: con trabajos de texto concurrentes se bloquearían las escrituras
+    cur.execute(
+        "SELECT 1 FROM pg_indexes "
+        "WHERE tablename = 'documentos_texto_bloques' AND indexname = 'documentos_texto_bloques_pagina_idx'"
+    )
+    if not cur.fetchone():
+        cur.execute(SQL_DOCUMENTOS_BLOQUES_IDX)
+    conn.commit()
+    _asegurar_unico(conn, cur)
+    cur.execute(
+        """
+        SELECT column_name FROM information_schema.columns
+         WHERE table_name = 'documentos_texto' AND column_name = ANY(%s)
+        """,
+        (list(COLUMNAS_EXTRA),),
+    )
+    existentes = {r[0] for r in cur.fetchall()}
+    faltan = [c for c in COLUMNAS_EXTRA if c not in existentes]
+    for col in faltan:
+        cur.execute(f"ALTER TABLE documentos_texto ADD COLUMN IF NOT EXISTS {col} {COLUMNAS_EXTRA[col]}")
+    if faltan:
+        conn.commit()
+
+def _conectar():
+    print(" Conectando a la base de datos...")
+    print(f"  -> {DB_CONFIG['dbname']}@{DB_CONFIG['host']}:{DB_CONFIG['port']}")
+    return psycopg2.connect(**DB_CONFIG)
+
+def extraer_documento(
+    upload_id: str,
+    file_path: str,
+    file_name: Optional[str],
+    content_type: Optional[str],
+    tipo: Optional[str],
+    texto_f,
+    bloques_f,
+    sha256_previo: Optional[str] = None,
+) -> Optional[dict]:
+    # Recorre la extracción una vez: el texto del documento y las filas de
+    # bloques van a texto_f / bloques_f (binarios) ya escapados para COPY; lo
+    # que devuelve es el resto de la fila de documentos_texto.
+    # None: el archivo tiene el mismo sha256 que la extracción guardada.
+    kind = _guess_kind(file_name or file_path, content_type)
+    with media_cache.abrir(file_path, suffix=_SUFIJOS.get(kind, ".bin")) as local_path:
+        if not os.path.exists(local_path):
+            raise FileNotFoundError(f"Archivo no encontrado: {file_path}")
+        sha256, _ = media_cache.hash_media(local_path)
+        if sha256 == sha256_previo:
+            return None
+        info = _extraer_local(upload_id, local_path, file_name, content_type, tipo, texto_f, bloques_f)
+    info["sha256"] = sha256
+    return info
+
+def _extraer_local(
+    upload_id: str,
+    local_path: str,
+    file_name: Optional[str],
+    content_type: Optional[str],
+    tipo: Optional[str],
+    texto_f,
+    bloques_f,
+) -> dict:
+    meta: dict = {}
+    stats = estadisticas_vacias()
+    primeros: List[str] = []
+    posiciones = []
+    documento_id = str(uuid.uuid4())
+    offset = 0
+    for n, (pagina, parrafo) in enumerate(
+        iterar_bloques(
+            file_path_or_url=local_path,
+            file_name_hint=file_name,
+            content_type_hint=content_type,
+            meta=meta,
+        )
+    ):
+        # sin NUL desde acá, para que los offsets coincidan con lo guardado
+        parrafo = parrafo.replace("\x00", "")
+        if n:
+            texto_f.write(b"\\n")
+            offset += 1
+        escapado = _copy_valor(parrafo)
+        texto_f.write(escapado.encode("utf-8"))
+        fila_bloque = [documento_id, n, pagina, offset]
+        bloques_f.write(
+            ("\t".join(_copy_valor(v) for v in fila_bloque) + "\t" + escapado + "\n").encode("utf-8")
+        )
+        if pagina is not None and (not posiciones or posiciones[-1]["pagina"] != pagina):
+            posiciones.append({"pagina": pagina, "parrafo": n, "offset": offset})
+        offset += len(parrafo)
+        sumar_estadisticas(stats, parrafo)
+        if len(primeros) < 2:
+            primeros.append(parrafo)
+    return {
+        "id": documento_id,
+        "upload_id": upload_id,
+        "tipo": tipo or "documento",
+        "file_name": file_name,
+        "meta": meta,
+        "stats": stats,
+        "resumen": " ".join(primeros),
+        "posiciones": posiciones,
+        "chars": offset,
+    }
+
+# COPY no admite ON CONFLICT: se carga a tablas temporales y desde ahí se
+# hace el upsert por upload_id, que solo pisa la fila si cambió el sha256
+SQL_TEMPORALES = """
+    CREATE TEMP TABLE IF NOT EXISTS documentos_texto_nuevos (LIKE documentos_texto) ON COMMIT DROP;
+    CREATE TEMP TABLE IF NOT EXISTS documentos_texto_bloques_nuevos (LIKE documentos_texto_bloques) ON COMMIT DROP;
+"""
+
+SQL_COPY_DOCUMENTOS = """
+    COPY documentos_texto_nuevos (
+        id, upload_id, tipo, texto, file_name, creado_en,
+        num_paginas, num_lineas, num_palabras, num_frases, resumen,
+        motor_extraccion, segundos_extraccion, posiciones, sha256
+    ) FROM STDIN
+"""
+
+SQL_COPY_BLOQUES = (
+    "COPY documentos_texto_bloques_nuevos (documento_id, parrafo, pagina, offset_chars, texto) FROM STDIN"
+)
+
+# los bloques viejos apuntan al id que el upsert reemplaza
+SQL_BORRAR_BLOQUES_VIEJOS = """
+    DELETE FROM documentos_texto_bloques bl
+     USING documentos_texto d, documentos_texto_nuevos n
+     WHERE bl.documento_id = d.id
+       AND d.upload_id = n.upload_id
+       AND d.sha256 IS DISTINCT FROM n.sha256
+"""
+
+SQL_UPSERT_DOCUMENTOS = """
+    INSERT INTO documentos_texto (
+        id, upload_id, tipo, texto, file_name, creado_en,
+        num_paginas, num_lineas, num_palabras, num_frases, resumen,
+        motor_extraccion, segundos_extraccion, posiciones, sha256
+    )
+    SELECT id, upload_id, tipo, texto, file_name, creado_en,
+           num_paginas, num_lineas, num_palabras, num_frases, resumen,
+           motor_extraccion, segundos_extraccion, posiciones, sha256
+      FROM documentos_texto_nuevos
+    ON CONFLICT (upload_id) DO UPDATE SET
+        id = EXCLUDED.id,
+        tipo = EXCLUDED.tipo,
+        texto = EXCLUDED.texto,
+        texto_extraido = NULL,
+        file_name = EXCLUDED.file_name,
+        creado_en = EXCLUDED.creado_en,
+        num_paginas = EXCLUDED.num_paginas,
+        num_lineas = EXCLUDED.num_lineas,
+        num_palabras = EXCLUDED.num_palabras,
+        num_frases = EXCLUDED.num_frases,
+        resumen = EXCLUDED.resumen,
+        motor_extraccion = EXCLUDED.motor_extraccion,
+        segundos_extraccion = EXCLUDED.segundos_extraccion,
+        posiciones = EXCLUDED.posiciones,
+        sha256 = EXCLUDED.sha256
+     WHERE documentos_texto.sha256 IS DISTINCT FROM EXCLUDED.sha256
+    RETURNING id
+"""
+
+# solo los bloques de los documentos que el upsert escribió
+SQL_INSERTAR_BLOQUES = """
+    INSERT INTO documentos_texto_bloques (documento_id, parrafo, pagina, offset_chars, texto)
+    SELECT b.documento_id, b.parrafo, b.pagina, b.offset_chars, b.texto
+      FROM documentos_texto_bloques_nuevos b
+      JOIN documentos_texto d ON d.id = b.documento_id
+"""
+
+def guardar_documentos(cur, documentos: list) -> int:
+    # documentos: [(info de extraer_documento, texto_f, bloques_f)]. Un COPY
+    # por tabla para todo el lote; el commit queda a cargo de quien llama.
+    # Devuelve cuántos documentos se escribieron (el resto no había cambiado).
+    partes_documentos: list = []
+    partes_bloques: list = []
+    for info, texto_f, bloques_f in documentos:
+        meta, stats = info["meta"], info["stats"]
+        fila = [
+            info["id"],
+            info["upload_id"],
+            info["tipo"],
+            None,  # texto: va aparte, desde el archivo temporal
+            info["file_name"],
+            datetime.now(),
+            meta.get("num_paginas"),
+            stats["num_lineas"],
+            stats["num_palabras"],
+            stats["num_frases"],
+            info["resumen"],
+            meta.get("motor"),
+            meta.get("segundos"),
+            json.dumps(info["posiciones"]) if info["posiciones"] else None,
+            info.get("sha256"),
+        ]
+        valores = [_copy_valor(v) for v in fila]
+        texto_f.seek(0)
+        bloques_f.seek(0)
+        partes_documentos += [
+            "\t".join(valores[:3]).encode("utf-8") + b"\t",
+            texto_f,
+            ("\t" + "\t".join(valores[4:]) + "\n").encode("utf-8"),
+        ]
+        partes_bloques.append(bloques_f)
+    cur.execute(SQL_TEMPORALES)
+    cur.copy_expert(SQL_COPY_DOCUMENTOS, _LectorCopy(partes_documentos))
+    cur.copy_expert(SQL_COPY_BLOQUES, _LectorCopy(partes_bloques))
+    cur.execute(SQL_BORRAR_BLOQUES_VIEJOS)
+    cur.execute(SQL_UPSERT_DOCUMENTOS)
+    escritos = len(cur.fetchall())
+    cur.execute(SQL_INSERTAR_BLOQUES)
+    cur.execute("DROP TABLE documentos_texto_nuevos, documentos_texto_bloques_nuevos")
+    return escritos
+
+def main(
+    upload_id: str,
+    propagar: bool = False,
+    url: Optional[str] = None,
+    file_name: Optional[str] = None,
+    content_type: Optional[str] = None,
+    tipo: Optional[str] = None,
+):
+    # propagar=True: los errores se relanzan (la cola de trabajos los reintenta)
+    # url (+ nombre / content type): si quien llama ya los conoce, no se
+    # consulta uploads
     conn = None
     try:
-        print(" Conectando a la base de datos...")
-        print(f"  -> {DB_CONFIG['dbname']}@{DB_CONFIG['host']}:{DB_CONFIG['port']}")
-        conn = psycopg2.connect(**DB_CONFIG)
+        conn = _conectar()
         cur = conn.cursor()
-
-        content_type = None
-        try:
-            cur.execute(
-                "SELECT file_path, file_name, tipo, NULL::text as content_type FROM uploads WHERE id = %s",
-                (upload_id,),
-            )
-        except Exception:
+        if url:
+            file_path = url
+            file_name = file_name or _nombre_desde_url(url)
+        else:
             cur.execute(
                 "SELECT file_path, file_name, tipo FROM uploads WHERE id = %s",
                 (upload_id,),
             )
-
-        row = cur.fetchone()
-        if not row:
-            print(f" No se encontró el documento con ID {upload_id}")
-            return
-
-        if len(row) == 4:
-            file_path, file_name, tipo, content_type = row
-        else:
+            row = cur.fetchone()
+            if not row:
+                print(f" No se encontró el documento con ID {upload_id}")
+                return
             file_path, file_name, tipo = row
-            content_type = None
 
         print(f" Procesando archivo: {file_name}")
 
-        parrafos = cargar_texto(
-            file_path_or_url=file_path,
-            file_name_hint=file_name,
-            content_type_hint=content_type,
-        )
-        texto_extraido = "\n".join(parrafos) if parrafos else ""
-        resumen = " ".join(parrafos[:2]) if parrafos else ""
-        stats = contar_palabras(texto_extraido)
-
-        cur.execute(
-            """
-            INSERT INTO documentos_texto (
-                upload_id, tipo, texto, file_name, texto_extraido, creado_en,
-                num_lineas, num_palabras, num_frases, resumen
+        _asegurar_tablas(conn, cur)
+        cur.execute("SELECT sha256 FROM documentos_texto WHERE upload_id = %s", (upload_id,))
+        previo = cur.fetchone()
+        conn.commit()  # sin transacción abierta durante la extracción
+
+        # el texto y los bloques quedan en memoria hasta TEXTO_SPOOL_BYTES y
+        # después en disco
+        with tempfile.SpooledTemporaryFile(max_size=TEXTO_SPOOL_BYTES, mode="w+b") as texto_f, \
+                tempfile.SpooledTemporaryFile(max_size=TEXTO_SPOOL_BYTES, mode="w+b") as bloques_f:
+            info = extraer_documento(
+                upload_id, file_path, file_name, content_type, tipo, texto_f, bloques_f,
+                sha256_previo=previo[0] if previo else None,
             )
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """,
-            (
-                upload_id,
-                (tipo or "documento"),
-                texto_extraido,
-                file_name,
-                texto_extraido,
-                datetime.now(),
-                stats["num_lineas"],
-                stats["num_palabras"],
-                stats["num_frases"],
-                resumen,
-            ),
-        )
+            if info is None:
+                print(" Sin cambios desde la última extracción (mismo sha256): se omite")
+                return
+            print(f" Extracción: {info['meta'].get('motor')} en {info['meta'].get('segundos')}s")
+            escritos = guardar_documentos(cur, [(info, texto_f, bloques_f)])
 
         conn.commit()
-        print(" ✅ Texto procesado y guardado correctamente en 'documentos_texto'")
+        if escritos:
+            print(" ✅ Texto procesado y guardado correctamente en 'documentos_texto'")
+        else:
+            print(" Otra corrida ya guardó este mismo contenido")
 
     except Exception as e:
         print(f" ❌ Error: {e}")
+        if propagar:
+            raise
     finally:
         if conn:
             try:
@@ -240,10 +803,28 @@ def main(upload_id: str):
                 pass
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
+    # procesar_texto.py <upload_id> [url]
+    # procesar_texto.py --json '{"upload_id": ..., "url": ..., "file_name": ..., "content_type": ...}'
+    args = sys.argv[1:]
+    job = {}
+    if "--json" in args:
+        i = args.index("--json")
+        try:
+            job = json.loads(args[i + 1]) if i + 1 < len(args) else {}
+        except ValueError:
+            job = {}
+        del args[i : i + 2]
+    upload_id = args[0] if args else job.get("upload_id")
+    if not upload_id:
         print(" Debes proporcionar el ID del upload como argumento.")
         sys.exit(1)
-    main(sys.argv[1])
+    main(
+        str(upload_id),
+        url=args[1] if len(args) >= 2 else job.get("url"),
+        file_name=job.get("file_name"),
+        content_type=job.get("content_type"),
+        tipo=job.get("tipo"),
+    )
 
 
 # # 
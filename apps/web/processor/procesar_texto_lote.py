@@ -0,0 +1,218 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Optional, Tuple
+
+import procesar_texto as pt
+
+# ----------------- Extracción de texto por lotes -----------------
+# Para backfills: una sola corrida procesa muchos uploads. Una conexión a la
+# DB (solo en el proceso principal), un pool de procesos que extraen en
+# paralelo (cada uno reusa su Session HTTP entre documentos) y escritura con
+# un COPY por tabla cada --lote documentos.
+#
+#   python procesar_texto_lote.py --pendientes --limite 1000
+#   python procesar_texto_lote.py <upload_id> <upload_id> ...
+#   python procesar_texto_lote.py --ids ids.txt --procesos 4
+
+LOTE_TMP_DIR = os.getenv("TEXTO_LOTE_TMP_DIR") or None  # None: el tmp del sistema
+
+SQL_PENDIENTES = """
+    SELECT u.id, u.file_path, u.file_name, u.tipo
+      FROM uploads u
+     WHERE (u.is_deleted IS NOT TRUE)
+       AND (
+            u.tipo = 'documento'
+         OR (u.tipo IS NULL AND lower(split_part(u.file_name, '.', -1))
+             IN ('pdf','docx','txt','md','csv','log','srt','vtt'))
+       )
+       AND NOT EXISTS (SELECT 1 FROM documentos_texto dt WHERE dt.upload_id::text = u.id)
+     ORDER BY u.uploaded_at
+     LIMIT %s
+"""
+
+SQL_POR_ID = "SELECT id, file_path, file_name, tipo FROM uploads WHERE id = ANY(%s)"
+
+SQL_HASHES = "SELECT upload_id::text, sha256 FROM documentos_texto WHERE upload_id::text = ANY(%s)"
+
+
+def _init_proceso():
+    # el paralelismo es entre documentos: cada PDF se extrae en un solo proceso
+    pt.PDF_PROCESOS = 1
+
+
+def _borrar(*paths: Optional[str]):
+    for path in paths:
+        if path:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def _extraer(job: dict) -> dict:
+    # Corre en el pool: el texto y los bloques quedan en archivos temporales
+    # (formato COPY) que el proceso principal carga y borra
+    texto_path = bloques_path = None
+    try:
+        fd, texto_path = tempfile.mkstemp(prefix="texto_", suffix=".copy", dir=LOTE_TMP_DIR)
+        os.close(fd)
+        fd, bloques_path = tempfile.mkstemp(prefix="bloques_", suffix=".copy", dir=LOTE_TMP_DIR)
+        os.close(fd)
+        with open(texto_path, "wb") as texto_f, open(bloques_path, "wb") as bloques_f:
+            info = pt.extraer_documento(
+                job["upload_id"], job["file_path"], job["file_name"], None, job["tipo"], texto_f, bloques_f,
+                sha256_previo=job.get("sha256"),
+            )
+        if info is None:
+            _borrar(texto_path, bloques_path)
+            return {"upload_id": job["upload_id"], "sin_cambios": True}
+        return {"info": info, "texto_path": texto_path, "bloques_path": bloques_path}
+    except Exception as e:
+        _borrar(texto_path, bloques_path)
+        return {"upload_id": job["upload_id"], "error": f"{type(e).__name__}: {e}"}
+
+
+def _escribir(conn, resultados: List[dict]) -> int:
+    abiertos = []
+    try:
+        for r in resultados:
+            abiertos.append((r["info"], open(r["texto_path"], "rb"), open(r["bloques_path"], "rb")))
+        cur = conn.cursor()
+        escritos = pt.guardar_documentos(cur, abiertos)
+        conn.commit()
+        return escritos
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        for _, texto_f, bloques_f in abiertos:
+            texto_f.close()
+            bloques_f.close()
+
+
+def _guardar_lote(conn, resultados: List[dict], errores: List[Tuple[str, str]]) -> int:
+    # Un COPY por tabla para todo el lote. Si falla, se reintenta documento por
+    # documento: solo el que rompe se agrega a errores
+    try:
+        if len(resultados) > 1:
+            try:
+                return _escribir(conn, resultados)
+            except Exception as e:
+                print(f" Aviso: falló el lote de {len(resultados)} documentos ({e}); se guardan de a uno")
+        escritos = 0
+        for r in resultados:
+            try:
+                escritos += _escribir(conn, [r])
+            except Exception as e:
+                upload_id = r["info"]["upload_id"]
+                errores.append((upload_id, f"{type(e).__name__}: {e}"))
+                print(f" ❌ {upload_id}: error al guardar: {e}")
+        return escritos
+    finally:
+        for r in resultados:
+            _borrar(r["texto_path"], r["bloques_path"])
+
+
+def _leer_ids(path: str) -> List[str]:
+    with open(path, encoding="utf-8") as f:
+        return [linea.strip() for linea in f if linea.strip() and not linea.startswith("#")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extracción de texto de muchos uploads en una corrida")
+    parser.add_argument("upload_ids", nargs="*")
+    parser.add_argument("--ids", help="archivo con un upload_id por línea")
+    parser.add_argument("--pendientes", action="store_true", help="documentos sin fila en documentos_texto")
+    parser.add_argument("--limite", type=int, default=1000, help="máximo de pendientes a tomar")
+    parser.add_argument("--procesos", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--lote", type=int, default=50, help="documentos por COPY / commit")
+    args = parser.parse_args()
+
+    ids = list(args.upload_ids)
+    if args.ids:
+        ids += _leer_ids(args.ids)
+    if not ids and not args.pendientes:
+        parser.error("indicá upload_ids, --ids o --pendientes")
+
+    conn = pt._conectar()
+    try:
+        cur = conn.cursor()
+        pt._asegurar_tablas(conn, cur)
+        filas = []
+        if ids:
+            cur.execute(SQL_POR_ID, (ids,))
+            filas += cur.fetchall()
+            faltan = set(ids) - {f[0] for f in filas}
+            if faltan:
+                print(f" Aviso: {len(faltan)} IDs no están en uploads: {', '.join(sorted(faltan)[:10])}")
+        if args.pendientes:
+            cur.execute(SQL_PENDIENTES, (args.limite,))
+            filas += cur.fetchall()
+        # hash de la última extracción: los archivos sin cambios no se reextraen
+        cur.execute(SQL_HASHES, ([f[0] for f in filas],))
+        hashes = dict(cur.fetchall())
+        conn.commit()
+        jobs = [
+            {"upload_id": uid, "file_path": path, "file_name": nombre, "tipo": tipo, "sha256": hashes.get(uid)}
+            for uid, path, nombre, tipo in {f[0]: f for f in filas}.values()
+            if path
+        ]
+        if not jobs:
+            print(" No hay documentos para procesar")
+            return
+        print(f" Procesando {len(jobs)} documentos con {args.procesos} procesos (lotes de {args.lote})")
+
+        t0 = time.perf_counter()
+        guardados = 0
+        errores: List[Tuple[str, str]] = []
+        sin_cambios = 0
+        chars = 0
+        paginas = 0
+        motores: dict = {}
+        pendientes: List[dict] = []
+        with ProcessPoolExecutor(max_workers=max(1, args.procesos), initializer=_init_proceso) as pool:
+            futuros = [pool.submit(_extraer, job) for job in jobs]
+            for i, futuro in enumerate(as_completed(futuros), start=1):
+                r = futuro.result()
+                if "error" in r:
+                    errores.append((r["upload_id"], r["error"]))
+                    print(f" ❌ {r['upload_id']}: {r['error']}")
+                    continue
+                if r.get("sin_cambios"):
+                    sin_cambios += 1
+                    continue
+                info = r["info"]
+                chars += info["chars"]
+                paginas += info["meta"].get("num_paginas") or 0
+                motor = info["meta"].get("motor") or "-"
+                motores[motor] = motores.get(motor, 0) + 1
+                pendientes.append(r)
+                if len(pendientes) >= args.lote:
+                    guardados += _guardar_lote(conn, pendientes, errores)
+                    pendientes = []
+                    dt = time.perf_counter() - t0
+                    print(f"  {i}/{len(jobs)}  {guardados} guardados  {i / dt:.1f} docs/s")
+            if pendientes:
+                guardados += _guardar_lote(conn, pendientes, errores)
+
+        dt = time.perf_counter() - t0
+        print(" ----------------- Resumen -----------------")
+        print(
+            f" Documentos: {len(jobs)}  guardados: {guardados}  sin cambios: {sin_cambios}  errores: {len(errores)}"
+        )
+        print(f" Tiempo: {dt:.1f}s  ->  {len(jobs) / dt:.2f} docs/s  {chars / 1e6 / dt:.2f} M caracteres/s")
+        if paginas:
+            print(f" Páginas PDF: {paginas}  ({paginas / dt:.1f} páginas/s)")
+        print(f" Motores: {', '.join(f'{m}={n}' for m, n in sorted(motores.items()))}")
+        if errores or guardados < len(jobs) - len(errores) - sin_cambios:
+            sys.exit(1)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -12,15 +12,71 @@ function buildUrl(row: any) {
   return file_path.startsWith("http") ? file_path : `${base}/${file_key}`;
 }
 
-export async function GET(req: Request) {
-  const { searchParams } = new URL(req.url);
-  const q = (searchParams.get("q") || "").trim();
+// DOCUMENTOS por bloque (documentos_texto_bloques, lo llena procesar_texto.py):
+// el snippet sale del primer párrafo/página que coincide, con su número de
+// página. Los documentos procesados antes de la tabla de bloques se buscan en
+// el texto completo.
+const DOCUMENTOS_POR_BLOQUES = `
+      SELECT
+        b.id,
+        b.file_name,
+        b.tipo,
+        b.file_path,
+        b.file_key,
+        b.uploaded_at,
+        'documento' AS matched_from,
+        coalesce(
+          substring(f.texto from greatest(position(lower($1) in lower(f.texto)) - 40, 1) for 160),
+          left(dt.resumen, 160)
+        ) AS snippet,
+        c.pagina
+      FROM base b
+      JOIN documentos_texto dt
+        ON dt.upload_id::text = b.id
+      CROSS JOIN LATERAL (
+        SELECT EXISTS (SELECT 1 FROM documentos_texto_bloques bl WHERE bl.documento_id = dt.id) AS con_bloques
+      ) k
+      LEFT JOIN LATERAL (
+        SELECT bl.texto, bl.pagina
+          FROM documentos_texto_bloques bl
+         WHERE k.con_bloques
+           AND bl.documento_id = dt.id
+           AND lower(bl.texto) LIKE '%' || lower($1) || '%'
+         ORDER BY bl.parrafo
+         LIMIT 1
+      ) c ON true
+      CROSS JOIN LATERAL (
+        SELECT CASE WHEN k.con_bloques THEN c.texto ELSE coalesce(dt.texto_extraido, dt.texto) END AS texto
+      ) f
+      WHERE b.tipo = 'documento'
+        AND (
+          lower(f.texto)        LIKE '%' || lower($1) || '%'
+          OR lower(b.file_name) LIKE '%' || lower($1) || '%'
+        )`;
 
-  if (!q) return NextResponse.json({ results: [] });
+// Sin la tabla de bloques (el procesador todavía no corrió con esta versión)
+const DOCUMENTOS_TEXTO_COMPLETO = `
+      SELECT
+        b.id,
+        b.file_name,
+        b.tipo,
+        b.file_path,
+        b.file_key,
+        b.uploaded_at,
+        'documento' AS matched_from,
+        substring(coalesce(dt.texto_extraido, dt.texto) from greatest(position(lower($1) in lower(coalesce(dt.texto_extraido, dt.texto))) - 40, 1) for 160) AS snippet,
+        NULL::integer AS pagina
+      FROM base b
+      JOIN documentos_texto dt
+        ON dt.upload_id::text = b.id
+      WHERE b.tipo = 'documento'
+        AND (
+          lower(coalesce(dt.texto_extraido, dt.texto)) LIKE '%' || lower($1) || '%'
+          OR lower(b.file_name)     LIKE '%' || lower($1) || '%'
+        )`;
 
-  try {
-    const { rows } = await pool.query(
-      `
+function consulta(documentos: string) {
+  return `
       WITH base AS (
         SELECT
           u.id::text AS id,   -- normalizamos a text
@@ -49,7 +105,8 @@ export async function GET(req: Request) {
         b.file_key,
         b.uploaded_at,
         'video' AS matched_from,
-        substring(s.text from greatest(position(lower($1) in lower(s.text)) - 40, 1) for 160) AS snippet
+        substring(s.text from greatest(position(lower($1) in lower(s.text)) - 40, 1) for 160) AS snippet,
+        NULL::integer AS pagina
       FROM base b
       JOIN video_subtitulos s
         ON s.video_id::text = b.id
@@ -59,29 +116,27 @@ export async function GET(req: Request) {
       UNION ALL
 
       -- DOCUMENTOS: buscar en texto extraído y/o nombre
-      SELECT
-        b.id,
-        b.file_name,
-        b.tipo,
-        b.file_path,
-        b.file_key,
-        b.uploaded_at,
-        'documento' AS matched_from,
-        substring(dt.texto_extraido from greatest(position(lower($1) in lower(dt.texto_extraido)) - 40, 1) for 160) AS snippet
-      FROM base b
-      JOIN documentos_texto dt
-        ON dt.upload_id::text = b.id
-      WHERE b.tipo = 'documento'
-        AND (
-          lower(dt.texto_extraido) LIKE '%' || lower($1) || '%'
-          OR lower(b.file_name)     LIKE '%' || lower($1) || '%'
-        )
+${documentos}
 
       ORDER BY uploaded_at DESC
       LIMIT 100
-      `,
-      [q]
-    );
+      `;
+}
+
+export async function GET(req: Request) {
+  const { searchParams } = new URL(req.url);
+  const q = (searchParams.get("q") || "").trim();
+
+  if (!q) return NextResponse.json({ results: [] });
+
+  try {
+    let rows: any[];
+    try {
+      ({ rows } = await pool.query(consulta(DOCUMENTOS_POR_BLOQUES), [q]));
+    } catch (e: any) {
+      if (e?.code !== "42P01") throw e;
+      ({ rows } = await pool.query(consulta(DOCUMENTOS_TEXTO_COMPLETO), [q]));
+    }
 
     const results = rows.map((r: any) => ({
       id: r.id as string,
@@ -89,6 +144,7 @@ export async function GET(req: Request) {
       url: buildUrl(r),
       tipo: r.tipo as "video" | "documento" | "desconocido",
       subtituloTexto: (r.snippet || "").trim(),
+      pagina: (r.pagina as number | null) ?? null,
       uploaded_at: r.uploaded_at,
     }));
 
@@ -0,0 +1,63 @@
+export const dynamic = "force-dynamic";
+
+import { NextRequest, NextResponse } from "next/server";
+import pool from "@/db";
+
+const LIMITE_DEFECTO = 50;
+const LIMITE_MAX = 500;
+
+// Lectura paginada del texto de un documento (upload id), sin traer el texto
+// completo:
+//   ?pagina=N              bloques de la página N (PDF)
+//   ?desde=P&limite=L      L bloques desde el párrafo P (todos los formatos)
+export async function GET(req: NextRequest, context: { params: Promise<{ id: string }> }) {
+  const { id } = await context.params;
+  const { searchParams } = new URL(req.url);
+  const pagina = searchParams.get("pagina");
+  const desde = Math.max(0, parseInt(searchParams.get("desde") || "0", 10) || 0);
+  const limite = Math.min(
+    LIMITE_MAX,
+    Math.max(1, parseInt(searchParams.get("limite") || String(LIMITE_DEFECTO), 10) || LIMITE_DEFECTO)
+  );
+
+  try {
+    const doc = await pool.query(
+      `SELECT id, num_paginas
+         FROM documentos_texto
+        WHERE upload_id = $1
+        ORDER BY creado_en DESC
+        LIMIT 1`,
+      [id]
+    );
+    if (doc.rows.length === 0) {
+      return NextResponse.json({ bloques: [] }, { status: 404 });
+    }
+    const { id: documentoId, num_paginas } = doc.rows[0];
+
+    const result = pagina
+      ? await pool.query(
+          `SELECT parrafo, pagina, offset_chars, texto
+             FROM documentos_texto_bloques
+            WHERE documento_id = $1 AND pagina = $2
+            ORDER BY parrafo`,
+          [documentoId, parseInt(pagina, 10) || 0]
+        )
+      : await pool.query(
+          `SELECT parrafo, pagina, offset_chars, texto
+             FROM documentos_texto_bloques
+            WHERE documento_id = $1 AND parrafo >= $2
+            ORDER BY parrafo
+            LIMIT $3`,
+          [documentoId, desde, limite + 1]
+        );
+
+    const bloques = pagina ? result.rows : result.rows.slice(0, limite);
+    const siguiente = !pagina && result.rows.length > limite ? desde + limite : null;
+    return NextResponse.json({ num_paginas, bloques, siguiente });
+  } catch (error: any) {
+    // la tabla la crea procesar_texto.py en su primera corrida
+    if (error?.code === "42P01") return NextResponse.json({ bloques: [], siguiente: null });
+    console.error("❌ Error al obtener bloques del documento:", error);
+    return NextResponse.json({ error: "Error al obtener bloques del documento" }, { status: 500 });
+  }
+}
@@ -1,43 +1,172 @@
 export const runtime = "nodejs";
 
-import { spawn } from "child_process";
+import { spawn, type ChildProcess } from "child_process";
 import path from "path";
 import { NextResponse } from "next/server";
 import pool from "@/db"; // asegúrate que apunta a localhost en local
 
+// Igual que COLA_ABANDONO_S en processor/cola_trabajos.py: un trabajo
+// en_proceso sin latido por más de esto ya no tiene worker
+const COLA_ABANDONO_S = 300;
+
 function getPythonCmd() {
   // En Windows suele ser "python" o "py -3"
   if (process.platform === "win32") return "python";
   return "python3";
 }
 
+// ----------------- Modo streaming (?stream=1) -----------------
+// El script con --jsonl escribe un evento JSON por línea ({"tipo": "segmento"}
+// por cada subtítulo y {"tipo": "fin"} al terminar). Se reenvían tal cual como
+// NDJSON para que el cliente pinte subtítulos parciales mientras transcribe.
+//
+// Ojo: esta ruta corre Whisper fuera de la cola de trabajos (cola_trabajos.py
+// y su carril "pesado"); el script delega en el worker persistente si está
+// vivo y si no carga su propio modelo. Los uploads nuevos pasan por la cola.
+//
+// Si el cliente corta la conexión se mata el proceso: el checkpoint
+// (subtitulos_progreso) hace que el próximo pedido reanude donde quedó.
+function streamSubtitulos(scriptPath: string, videoId: string) {
+  const encoder = new TextEncoder();
+  let cerrado = false;
+  let child: ChildProcess | null = null;
+
+  const stream = new ReadableStream<Uint8Array>({
+    start(controller) {
+      // sin shell: el id viene de la URL y va como argumento, no se interpreta
+      const proc = spawn(getPythonCmd(), [scriptPath, videoId, "--jsonl"], {
+        cwd: process.cwd(),
+        shell: false,
+      });
+      child = proc;
+
+      let pendiente = "";
+      let stderrBuf = "";
+      const enviar = (obj: unknown) => {
+        if (cerrado) return;
+        try {
+          controller.enqueue(encoder.encode(JSON.stringify(obj) + "\n"));
+        } catch {
+          cerrado = true; // el stream ya estaba cerrado
+        }
+      };
+
+      proc.stdout.on("data", (d) => {
+        pendiente += d.toString();
+        const lineas = pendiente.split("\n");
+        pendiente = lineas.pop() ?? "";
+        for (const linea of lineas) {
+          // el resto del stdout son los logs del script
+          try {
+            const ev = JSON.parse(linea);
+            if (ev && typeof ev.tipo === "string") enviar(ev);
+          } catch {}
+        }
+      });
+      proc.stderr.on("data", (d) => (stderrBuf += d.toString()));
+
+      const terminar = (exitCode: number) => {
+        if (cerrado) return;
+        enviar({
+          tipo: "salida",
+          success: exitCode === 0,
+          exitCode,
+          ...(exitCode !== 0 ? { stderr: stderrBuf } : {}),
+        });
+        if (cerrado) return;
+        cerrado = true;
+        controller.close();
+      };
+      proc.on("error", () => terminar(999)); // error de spawn
+      proc.on("close", (code) => terminar(code ?? 999));
+    },
+    cancel() {
+      // el cliente se fue: no se encola nada más y se corta el script
+      cerrado = true;
+      if (child && child.exitCode === null && !child.killed) child.kill("SIGTERM");
+    },
+  });
+
+  return new Response(stream, {
+    headers: {
+      "Content-Type": "application/x-ndjson; charset=utf-8",
+      "Cache-Control": "no-store",
+    },
+  });
+}
+
 export async function POST(
-  _req: Request,
+  req: Request,
   { params }: { params: { id: string } }
 ) {
   const videoId = params.id;
+  const streaming = new URL(req.url).searchParams.get("stream") === "1";
 
   try {
     // 1) Si ya existen subtítulos, no reprocesar
-    const pre = await pool.query(
-      "SELECT 1 FROM video_subtitulos WHERE video_id = $1 LIMIT 1",
-      [videoId]
-    );
+    //    (un trabajo a medias tiene filas pero su checkpoint no está completo:
+    //    en ese caso se relanza el script y reanuda)
+    let pre;
+    try {
+      pre = await pool.query(
+        `SELECT 1 FROM video_subtitulos s
+          WHERE s.video_id = $1
+            AND NOT EXISTS (
+              SELECT 1 FROM subtitulos_progreso p
+               WHERE p.video_id = $1 AND NOT p.completado
+            )
+          LIMIT 1`,
+        [videoId]
+      );
+    } catch (error: any) {
+      // la tabla subtitulos_progreso aún no existe (ningún trabajo la creó)
+      if (error?.code !== "42P01") throw error;
+      pre = await pool.query(
+        "SELECT 1 FROM video_subtitulos WHERE video_id = $1 LIMIT 1",
+        [videoId]
+      );
+    }
 if (pre && typeof pre.rowCount === "number" && pre.rowCount > 0) {
 
       return NextResponse.json({ success: true, message: "Ya procesado" });
     }
 
+    // 1b) Si la cola de trabajos ya lo tiene (pendiente o con un worker vivo),
+    //     no lanzar otro proceso: ambos reanudarían del mismo checkpoint e
+    //     insertarían los mismos segmentos dos veces
+    try {
+      const activo = await pool.query(
+        `SELECT estado FROM trabajos
+          WHERE upload_id = $1 AND tipo = 'subtitulos'
+            AND (estado = 'pendiente'
+                 OR (estado = 'en_proceso' AND latido_en > now() - interval '${COLA_ABANDONO_S} seconds'))
+          ORDER BY id DESC
+          LIMIT 1`,
+        [videoId]
+      );
+      if (activo.rows.length > 0) {
+        return NextResponse.json(
+          { success: true, message: "En proceso", estado: activo.rows[0].estado },
+          { status: 202 }
+        );
+      }
+    } catch (error: any) {
+      // la tabla la crea el daemon en su primer arranque
+      if (error?.code !== "42P01") throw error;
+    }
+
     // 2) Ejecutar script
     const scriptPath = path.join(process.cwd(), "processor", "procesar_subtitulos.py");
     const pythonCmd = getPythonCmd();
 
+    if (streaming) return streamSubtitulos(scriptPath, videoId);
+
     let stdoutBuf = "";
     let stderrBuf = "";
 
     const child = spawn(pythonCmd, [scriptPath, videoId], {
       cwd: process.cwd(),
-      shell: true,
+      shell: false,
     });
 
     child.stdout.on("data", (d) => (stdoutBuf += d.toString()));
@@ -29,9 +29,24 @@ export async function GET(
       `SELECT time_start, time_end, text FROM video_subtitulos WHERE video_id = $1 ORDER BY time_start ASC`,
       [videoId]
     );
+
+    // Los subtítulos se guardan por bloques mientras se transcribe: el header
+    // avisa si todavía faltan (el polling del cliente sigue hasta completo=1)
+    let completo = true;
+    try {
+      const prog = await client.query(
+        "SELECT completado FROM subtitulos_progreso WHERE video_id = $1",
+        [videoId]
+      );
+      if (prog.rowCount) completo = Boolean(prog.rows[0].completado);
+    } catch {
+      // tabla aún no creada: solo existen trabajos antiguos (completos)
+    }
     client.release();
 
-    return NextResponse.json(result.rows);
+    return NextResponse.json(result.rows, {
+      headers: { "X-Subtitulos-Completo": completo ? "1" : "0" },
+    });
   } catch (error) {
     console.error("❌ Error al obtener subtítulos:", error);
     return new NextResponse("Error interno del servidor", { status: 500 });
@@ -0,0 +1,29 @@
+export const dynamic = "force-dynamic";
+
+import { NextResponse } from "next/server";
+import pool from "@/db";
+
+type Ctx<T extends Record<string, string>> = { params: Promise<T> };
+
+// Estado de los trabajos de procesamiento (cola 'trabajos') de un upload.
+// Pensado para polling desde la UI: pendiente | en_proceso | completado | error
+export async function GET(_req: Request, context: Ctx<{ id: string }>) {
+  const { id } = await context.params;
+
+  try {
+    const result = await pool.query(
+      `SELECT id, tipo, estado, prioridad, costo, intentos, max_intentos, error, resultado,
+              creado_en, iniciado_en, terminado_en, disponible_en
+         FROM trabajos
+        WHERE upload_id = $1
+        ORDER BY id DESC`,
+      [id]
+    );
+    return NextResponse.json(result.rows);
+  } catch (error: any) {
+    // la tabla la crea el daemon en su primer arranque
+    if (error?.code === "42P01") return NextResponse.json([]);
+    console.error("❌ Error al obtener trabajos:", error);
+    return new NextResponse("Error interno del servidor", { status: 500 });
+  }
+}
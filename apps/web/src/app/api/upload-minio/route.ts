@@ -316,27 +316,67 @@ export async function POST(req: NextRequest) {
       }
     }
 
-    // 5) Procesamiento posterior (igual que tenías)
+    // 5) Procesamiento posterior: se encola en 'trabajos' y lo toma el daemon
+    //    processor/cola_trabajos.py (con concurrencia acotada). Si la tabla aún
+    //    no existe (daemon nunca iniciado) se lanza el script como antes.
     const python =
       process.platform === "win32"
         ? "C:\\Users\\ALLINONE06\\AppData\\Local\\Programs\\Python\\Python310\\python.exe"
         : "python3";
 
     let scriptPath = "";
+    let tipoTrabajo = "";
     if (["mp4", "mov", "mkv", "webm", "m4v"].includes(ext)) {
+      tipoTrabajo = "subtitulos";
       scriptPath = path.join(
         process.cwd(),
         "processor",
         "procesar_subtitulos.py"
       );
     } else if (["pdf", "docx", "txt", "doc"].includes(ext)) {
+      tipoTrabajo = "texto";
       scriptPath = path.join(process.cwd(), "processor", "procesar_texto.py");
     }
 
-    if (scriptPath) {
-      const proceso = spawn(python, [scriptPath, rowId, publicUrl], {
+    let encolado = false;
+    if (tipoTrabajo) {
+      try {
+        await pool.query(
+          `INSERT INTO trabajos (upload_id, tipo, payload)
+           VALUES ($1, $2, $3)
+           ON CONFLICT (upload_id, tipo) WHERE estado IN ('pendiente', 'en_proceso') DO NOTHING`,
+          [
+            rowId,
+            tipoTrabajo,
+            JSON.stringify({
+              url: publicUrl,
+              file_name: filename,
+              content_type: file.type || null,
+              tipo,
+            }),
+          ]
+        );
+        await pool.query("SELECT pg_notify('trabajos', $1)", [tipoTrabajo]);
+        encolado = true;
+      } catch (err: any) {
+        if (err?.code !== "42P01") throw err; // 42P01 = tabla inexistente
+      }
+    }
+
+    if (scriptPath && !encolado) {
+      // El script recibe URL, nombre y content type: no vuelve a consultar
+      // uploads. Sin shell, para que nombres con espacios o comillas lleguen
+      // intactos dentro del JSON.
+      const job = JSON.stringify({
+        upload_id: rowId,
+        url: publicUrl,
+        file_name: filename,
+        content_type: file.type || null,
+        tipo,
+      });
+      const proceso = spawn(python, [scriptPath, "--json", job], {
         cwd: process.cwd(),
-        shell: true,
+        shell: false,
       });
       proceso.stdout.on("data", (d) =>
         console.log(`[STDOUT ${ext}]:`, d.toString())
@@ -349,7 +389,7 @@ export async function POST(req: NextRequest) {
     // 6) Respuesta
     return NextResponse.json({
       id: rowId,
-      message: `✅ ${ext.toUpperCase()} subido y procesándose`,
+      message: `✅ ${ext.toUpperCase()} subido y ${encolado ? "en cola" : "procesándose"}`,
       url: publicUrl,
       key: fileKey,
       tipo,
@@ -5,6 +5,7 @@ export type VideoInfo = {
   name: string;
   url: string;
   subtituloTexto?: string;
+  pagina?: number | null; // documentos: página del resultado de búsqueda
   mimeType?: string;
   sizeBytes?: number;
   created_at?: string;
@@ -175,10 +175,13 @@ export default function VideoDetailPage({ id }: { id: string }) {
           if (url) setVideoUrl(url);
 
           try {
-            const subs = await fetchJSON<any[]>(`/api/subtitulos/${id}`);
+            const res = await fetch(`/api/subtitulos/${id}`, { cache: "no-store" });
+            if (!res.ok) throw new Error(`HTTP ${res.status}`);
+            const subs = await res.json();
+            const completo = res.headers.get("x-subtitulos-completo") !== "0";
             if (!cancel) {
-              if (Array.isArray(subs) && subs.length > 0) {
-                setSubtitulos(subs);
+              if (Array.isArray(subs) && subs.length > 0) setSubtitulos(subs);
+              if (Array.isArray(subs) && subs.length > 0 && completo) {
                 stopPolling();
               } else {
                 startPolling();
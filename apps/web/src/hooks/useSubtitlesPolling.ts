@@ -1,5 +1,7 @@
 // Hook personalizado para obtener subtítulos de un video por polling.
 // - Llama periódicamente al endpoint de subtítulos.
+// - Mientras la transcripción sigue (header X-Subtitulos-Completo: 0) va
+//   mostrando los subtítulos parciales y no deja de consultar.
 // - Devuelve el array de subtítulos, estado de polling y funciones start/stop.
 // - Normaliza cada fila con __startSec (segundos) para facilitar el seek del video.
 // - Se limpia automáticamente al desmontar el componente.
@@ -108,10 +110,13 @@ export function useSubtitlesPolling(id: string | null) {
         const res = await fetch(`/api/subtitulos/${id}?t=${Date.now()}`, { cache: "no-store" });
         if (!res.ok) return;
         const data = await res.json();
+        const completo = res.headers.get("x-subtitulos-completo") !== "0";
         if (Array.isArray(data) && data.length > 0) {
-          stop();
           setSubtitulos(data); // 👈 normaliza aquí
-          setPolling(false);
+          if (completo) {
+            stop();
+            setPolling(false);
+          }
         }
       } catch {}
     }, 2000);